@@ -0,0 +1,152 @@
+import argparse
+import os
+import random
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# The cohort generator reuses the per-server generators and their shared code,
+# which live next to it in the repository (and in the same layout inside the container)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATOR_DIRS = {
+    "maternal": os.path.join(ROOT, "serverA", "data-generator"),
+    "fetal": os.path.join(ROOT, "serverB", "data-generator"),
+    "obstetric": os.path.join(ROOT, "serverC", "data-generator")
+}
+sys.path.insert(0, os.path.join(ROOT, "generator-common"))
+
+from fhir_client import FHIRClient, POOL_MAXSIZE, transaction_bundle
+from load_runner import LatencyRecorder, RateLimiter, run_workers
+from generator_cli import load_generator
+
+SERVER_URLS = {
+    "maternal": os.getenv("MATERNAL_FHIR_URL", "http://maternal-fhir:8080/fhir"),
+    "fetal": os.getenv("FETAL_FHIR_URL", "http://fetal-fhir:8080/fhir"),
+    "obstetric": os.getenv("OBSTETRIC_FHIR_URL", "http://obstetric-fhir:8080/fhir")
+}
+
+# Each server's generate_fhir_data.py, imported under a unique module name
+maternal, fetal, obstetric = (
+    load_generator(os.path.join(GENERATOR_DIRS[name], "generate_fhir_data.py"), f"{name}_generator")
+    for name in ("maternal", "fetal", "obstetric")
+)
+
+# One client per server, created in main()
+clients = {}
+
+def post_transaction(name, entries):
+    """Post entries as one transaction Bundle to a server"""
+    response = clients[name].transaction(transaction_bundle(entries))
+    if response.status_code != 200:
+        raise Exception(f"Failed to post transaction to {clients[name].base_url}: {response.text}")
+    return len(entries)
+
+def build_cohort_entries(count, twin_rate):
+    """
+    Build the maternal, fetal and obstetric transaction entries for count mothers.
+
+    Patient ids are assigned up front, so fetal Patients (server B) can link to
+    their mother and CarePlans/RiskAssessments (server C) can reference her and
+    her fetuses before any of them exist. That lets the three servers be
+    written in parallel.
+    """
+    maternal_entries, fetal_entries, obstetric_entries = [], [], []
+    for _ in range(count):
+        maternal_id = str(uuid.uuid4())
+        maternal_ref = f"{SERVER_URLS['maternal']}/Patient/{maternal_id}"
+        maternal_entries.extend(maternal.build_patient_entries(maternal_id))
+
+        fetal_refs = []
+        for _ in range(2 if random.random() < twin_rate else 1):
+            fetal_id = str(uuid.uuid4())
+            fetal_refs.append(f"{SERVER_URLS['fetal']}/Patient/{fetal_id}")
+            fetal_entries.extend(fetal.build_patient_entries(maternal_ref, fetal_id))
+
+        obstetric_entries.extend(obstetric.build_care_entries(maternal_ref, fetal_refs))
+    return maternal_entries, fetal_entries, obstetric_entries
+
+def create_cohort_batch(start, total, batch_size, twin_rate, server_pool):
+    """Create the mothers in [start, start + batch_size) on all three servers at once"""
+    count = min(batch_size, total - start)
+    try:
+        maternal_entries, fetal_entries, obstetric_entries = build_cohort_entries(count, twin_rate)
+        jobs = [
+            server_pool.submit(post_transaction, "maternal", maternal_entries),
+            server_pool.submit(post_transaction, "fetal", fetal_entries),
+            server_pool.submit(post_transaction, "obstetric", obstetric_entries)
+        ]
+        created = sum(job.result() for job in jobs)
+        print(f"Created cohort {start+1}-{start+count}/{total} with {created} resources across all servers")
+    except Exception as e:
+        print(f"Error processing cohort {start+1}-{start+count}: {str(e)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate linked maternal, fetal and obstetric records")
+    parser.add_argument(
+        "--patients",
+        type=int,
+        default=int(os.getenv("PATIENT_COUNT", "5")),
+        help="Number of mothers in the cohort"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("BATCH_SIZE", "1")),
+        help="Mothers per transaction Bundle"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WORKERS", "1")),
+        help="Number of concurrent worker threads"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=float(os.getenv("RATE", "0")),
+        help="Target requests per second per server; 0 means unlimited"
+    )
+    parser.add_argument(
+        "--twin-rate",
+        type=float,
+        default=float(os.getenv("TWIN_RATE", "0.03")),
+        help="Fraction of pregnancies with two fetuses"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=int(os.environ["SEED"]) if "SEED" in os.environ else None,
+        help="Random seed, for reproducible data (fully reproducible with one worker)"
+    )
+    return parser.parse_args()
+
+def main():
+    """Generate a cross-server cohort of linked prenatal records"""
+    args = parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    
+    for name, url in SERVER_URLS.items():
+        clients[name] = FHIRClient(
+            url,
+            pool_maxsize=max(args.workers, POOL_MAXSIZE),
+            recorder=LatencyRecorder(),
+            rate_limiter=RateLimiter(args.rate) if args.rate > 0 else None
+        )
+    
+    print("Starting cohort data generation...")
+    
+    with ThreadPoolExecutor(max_workers=3 * max(args.workers, 1)) as server_pool:
+        run_workers(
+            lambda start: create_cohort_batch(start, args.patients, args.batch_size, args.twin_rate, server_pool),
+            range(0, args.patients, args.batch_size),
+            args.workers
+        )
+    
+    print("Cohort data generation complete!")
+    for name, client in clients.items():
+        print(f"--- {name} ---")
+        client.recorder.report()
+
+if __name__ == "__main__":
+    main()
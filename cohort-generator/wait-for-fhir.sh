@@ -0,0 +1,20 @@
+#!/bin/bash
+
+# Print a message indicating the script is waiting for the HAPI FHIR servers to be ready
+echo "Waiting for HAPI FHIR servers to be ready..."
+
+# Loop until every HAPI FHIR server is available
+for server in maternal-fhir fetal-fhir obstetric-fhir; do
+    until curl --output /dev/null --silent --fail http://$server:8080/fhir/metadata; do
+        # Print a message indicating the server is still not ready
+        echo "Waiting for $server..."
+        # Wait for 5 seconds before checking again
+        sleep 5
+    done
+done
+
+# Print a message indicating the servers are ready
+echo "HAPI FHIR servers are ready! Running cohort generator..."
+
+# Run the Python script to generate the linked cohort
+python generate_cohort.py
\ No newline at end of file
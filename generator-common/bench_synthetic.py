@@ -0,0 +1,37 @@
+import argparse
+import tempfile
+import time
+from generator_cli import load_generator, export_patients, export_patients_vectorized
+
+def bench(label, export, patients):
+    """Time one engine writing patients to a scratch directory, returning resources/sec"""
+    with tempfile.TemporaryDirectory() as output_dir:
+        started = time.perf_counter()
+        written = export(patients, output_dir)
+        elapsed = time.perf_counter() - started
+    rate = written / elapsed if elapsed else 0
+    return label, patients, written, elapsed, rate
+
+def main():
+    """Compare the classic and vectorized generation engines of a server's generator"""
+    parser = argparse.ArgumentParser(description="Benchmark synthetic data generation")
+    parser.add_argument("generator", nargs="?", default="generate_fhir_data.py", help="Path to a server's generate_fhir_data.py")
+    parser.add_argument("--patients", type=int, default=100000, help="Patients for the vectorized engine")
+    parser.add_argument("--classic-patients", type=int, default=2000, help="Patients for the classic engine")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generator = load_generator(args.generator)
+    
+    results = [
+        bench("classic", lambda total, output_dir: export_patients(generator, total, output_dir), args.classic_patients),
+        bench("vectorized", lambda total, output_dir: export_patients_vectorized(generator, total, output_dir, args.seed), args.patients)
+    ]
+    
+    print(f"{'engine':<12}{'patients':>10}{'resources':>12}{'seconds':>10}{'resources/s':>14}")
+    for label, patients, written, elapsed, rate in results:
+        print(f"{label:<12}{patients:>10}{written:>12}{elapsed:>10.2f}{rate:>14.0f}")
+    if results[0][4]:
+        print(f"vectorized speedup: {results[1][4] / results[0][4]:.1f}x")
+
+if __name__ == "__main__":
+    main()
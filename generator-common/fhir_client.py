@@ -0,0 +1,109 @@
+import os
+import time
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connection pool and retry settings of the data generators (the search service
+# has its own, see its config.py): POOL_CONNECTIONS is the number of per-host
+# pools requests keeps, POOL_MAXSIZE the connections kept in each
+POOL_CONNECTIONS = int(os.getenv("FHIR_POOL_CONNECTIONS", "10"))
+POOL_MAXSIZE = int(os.getenv("FHIR_POOL_MAXSIZE", "20"))
+MAX_RETRIES = int(os.getenv("FHIR_MAX_RETRIES", "5"))
+BACKOFF_FACTOR = float(os.getenv("FHIR_BACKOFF_FACTOR", "0.5"))
+RETRY_STATUSES = (429, 503)
+TIMEOUT = float(os.getenv("FHIR_TIMEOUT", "30"))
+
+class FHIRClient:
+    """
+    Pooled, keep-alive HTTP client for a single FHIR server.
+
+    Every request goes through one requests.Session, so connections are reused
+    instead of being opened for each resource. Requests answered with 429 or 503
+    are retried with exponential backoff, honouring Retry-After.
+
+    An optional recorder (see load_runner.LatencyRecorder) receives the latency
+    of every write, and an optional rate limiter paces them.
+    """
+
+    def __init__(self, base_url, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                 max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, timeout=TIMEOUT,
+                 recorder=None, rate_limiter=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.recorder = recorder
+        self.rate_limiter = rate_limiter
+        retry = Retry(
+            total=max_retries,
+            read=0,  # a read timeout may come after the server created the resource, so never resend
+            other=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=None,  # 429/503 mean the request was not processed, so POST is safe to retry
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Accept": "application/fhir+json",
+            "Content-Type": "application/fhir+json"
+        })
+
+    def url(self, path=""):
+        return f"{self.base_url}/{path}" if path else self.base_url
+
+    def get(self, path="", params=None):
+        return self.session.get(self.url(path), params=params, timeout=self.timeout)
+
+    def post(self, path, resource):
+        return self.write("POST", path, resource, resource["resourceType"])
+
+    def put(self, path, resource):
+        return self.write("PUT", path, resource, resource["resourceType"])
+
+    def transaction(self, bundle):
+        return self.write("POST", "", bundle, "transaction")
+
+    def write(self, method, path, body, label):
+        """Send a write request, pacing and timing it when configured to"""
+        if self.rate_limiter:
+            self.rate_limiter.wait()
+        started = time.perf_counter()
+        response = self.session.request(method, self.url(path), json=body, timeout=self.timeout)
+        if self.recorder:
+            self.recorder.record(label, time.perf_counter() - started, response.status_code < 300)
+        return response
+
+    def close(self):
+        self.session.close()
+
+def transaction_entry(resource, full_url=None, resource_id=None):
+    """
+    Wrap a resource as an entry of a transaction Bundle. The urn:uuid fullUrl
+    lets other entries in the same Bundle reference it.
+
+    Without resource_id the server assigns the id (POST). With it the entry
+    becomes a PUT to that id, so references to the resource can be built
+    before it exists, even from other servers.
+    """
+    if resource_id:
+        resource["id"] = resource_id
+        request = {"method": "PUT", "url": f"{resource['resourceType']}/{resource_id}"}
+    else:
+        request = {"method": "POST", "url": resource["resourceType"]}
+    return {
+        "fullUrl": full_url or f"urn:uuid:{resource_id or uuid.uuid4()}",
+        "resource": resource,
+        "request": request
+    }
+
+def transaction_bundle(entries):
+    return {
+        "resourceType": "Bundle",
+        "type": "transaction",
+        "entry": entries
+    }
@@ -0,0 +1,247 @@
+import argparse
+import importlib.util
+import os
+import random
+import time
+from datetime import datetime, timezone
+from fhir_client import FHIRClient, POOL_MAXSIZE, transaction_bundle
+from load_runner import LatencyRecorder, RateLimiter, run_workers, run_bounded
+from ndjson_export import NDJSONWriter, rewrite_references
+from synthetic import SyntheticEngine
+from timeline import SCHEDULES, now
+
+# Command line and drivers shared by the per-server generators. Each server's
+# generate_fhir_data.py supplies only its builders:
+#   BASE_URL                                          default server to post to
+#   build_patient_entries()                           one patient's transaction entries
+#   build_longitudinal_entries(schedule, reference_time)  one patient's visits
+#   build_templates()                                 Patient and record templates
+#   build_rows(engine, n)                             template values of n patients
+
+def load_generator(path, name="generate_fhir_data"):
+    """Import a server's generate_fhir_data.py from its path, under the given module name"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("BATCH_SIZE", "0")),
+        help="Patients per transaction Bundle; 0 posts every resource separately"
+    )
+    parser.add_argument(
+        "--patients",
+        type=int,
+        default=int(os.getenv("PATIENT_COUNT", "5")),
+        help="Number of patients to generate"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WORKERS", "1")),
+        help="Number of concurrent worker threads"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=float(os.getenv("RATE", "0")),
+        help="Target requests per second across all workers; 0 means unlimited"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=os.getenv("OUTPUT_DIR"),
+        help="Write gzip'd NDJSON files (FHIR Bulk Data format) here instead of posting to the server"
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["classic", "vectorized"],
+        default=os.getenv("ENGINE", "classic"),
+        help="Generation engine for --output-dir: per-call random values, or seeded NumPy columns"
+    )
+    parser.add_argument(
+        "--reference-date",
+        type=lambda value: datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc),
+        default=os.getenv("REFERENCE_DATE"),
+        help="Timestamp base (YYYY-MM-DD) for the vectorized engine; with --seed it makes output byte-identical"
+    )
+    parser.add_argument(
+        "--longitudinal",
+        action="store_true",
+        default=os.getenv("LONGITUDINAL", "").lower() in ("1", "true", "yes"),
+        help="Simulate every prenatal visit from conception to delivery instead of one snapshot per patient"
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=sorted(SCHEDULES),
+        default=os.getenv("SCHEDULE", "standard"),
+        help="Visit schedule for --longitudinal"
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=int(os.environ["SEED"]) if "SEED" in os.environ else None,
+        help="Random seed, for reproducible data (fully reproducible with one worker)"
+    )
+    return parser.parse_args()
+
+def create_patient(client, entries):
+    """
+    Create a patient and their records with one request per resource, returning
+    the patient's id. References to the Patient's urn:uuid fullUrl are rewritten
+    to the id the server assigned.
+    """
+    patient_entry, *record_entries = entries
+    response = client.post("Patient", patient_entry["resource"])
+    if response.status_code != 201:
+        raise Exception(f"Failed to create patient: {response.text}")
+    patient_id = response.json()["id"]
+
+    targets = {patient_entry["fullUrl"]: f"Patient/{patient_id}"}
+    for entry in record_entries:
+        resource = entry["resource"]
+        rewrite_references(resource, targets)
+        response = client.post(resource["resourceType"], resource)
+        if response.status_code != 201:
+            print(f"Failed to create {resource['resourceType']}: {response.text}")
+    return patient_id
+
+def generate_patient(generator, client, i, total):
+    """Create one patient and their records, one request per resource"""
+    try:
+        entries = generator.build_patient_entries()
+        patient_id = create_patient(client, entries)
+        print(f"Created patient {i+1}/{total} with ID: {patient_id} and {len(entries) - 1} records")
+    except Exception as e:
+        print(f"Error processing patient {i+1}: {str(e)}")
+
+def generate_batch(generator, client, start, total, batch_size):
+    """Create the patients in [start, start + batch_size) in one transaction Bundle"""
+    count = min(batch_size, total - start)
+    try:
+        entries = []
+        for _ in range(count):
+            entries.extend(generator.build_patient_entries())
+        response = client.transaction(transaction_bundle(entries))
+        if response.status_code != 200:
+            raise Exception(f"Failed to post transaction: {response.text}")
+        print(f"Created patients {start+1}-{start+count}/{total} with {len(entries)} resources in one transaction")
+    except Exception as e:
+        print(f"Error processing patients {start+1}-{start+count}: {str(e)}")
+
+def generate_longitudinal(generator, client, total, schedule, output_dir=None, workers=1):
+    """
+    Follow patients through their whole pregnancy, writing to NDJSON files or
+    posting one transaction per patient. Each patient's timeline is built and
+    written on its own, so memory use does not grow with the cohort.
+    """
+    reference_time = now()
+    writer = NDJSONWriter(output_dir) if output_dir else None
+
+    def follow(i):
+        try:
+            entries = list(generator.build_longitudinal_entries(schedule, reference_time))
+            if writer:
+                writer.write_entries(entries)
+            else:
+                response = client.transaction(transaction_bundle(entries))
+                if response.status_code != 200:
+                    raise Exception(f"Failed to post transaction: {response.text}")
+            print(f"Generated {len(entries)} resources over the pregnancy of patient {i+1}/{total}")
+        except Exception as e:
+            print(f"Error processing patient {i+1}: {str(e)}")
+
+    try:
+        run_bounded(follow, range(total), workers)
+    finally:
+        if writer:
+            writer.close()
+
+def report_export(written, total, output_dir, started):
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written} resources for {total} patients to {output_dir} in {elapsed:.1f}s "
+          f"({written / elapsed if elapsed else 0:.0f} resources/s)")
+
+def export_patients_vectorized(generator, total, output_dir, seed=None, reference_time=None, chunk_size=10000):
+    """
+    Write patients and their records to NDJSON files using the vectorized engine.
+    Each chunk of patients draws its values column by column with NumPy (see the
+    generator's build_rows), then stamps them into prebuilt templates.
+    """
+    engine = SyntheticEngine(seed, reference_time)
+    patient_template, record_templates = generator.build_templates()
+    effective = engine.timestamp()
+    per_patient = 1 + len(record_templates)
+    writer = NDJSONWriter(output_dir)
+    started = time.perf_counter()
+    written = 0
+    try:
+        for start in range(0, total, chunk_size):
+            n = min(chunk_size, total - start)
+            ids = engine.ids(n * per_patient)
+            for i, (patient_values, record_values) in enumerate(generator.build_rows(engine, n)):
+                row_ids = ids[i * per_patient:(i + 1) * per_patient]
+                writer.write_line("Patient", patient_template.stamp(id=f'"{row_ids[0]}"', **patient_values))
+                values = {"subject": f'"Patient/{row_ids[0]}"', "effective": effective, **record_values}
+                for resource_id, (resource_type, template) in zip(row_ids[1:], record_templates):
+                    writer.write_line(resource_type, template.stamp(id=f'"{resource_id}"', **values))
+            written += n * per_patient
+    finally:
+        writer.close()
+    report_export(written, total, output_dir, started)
+    return written
+
+def export_patients(generator, total, output_dir):
+    """Write patients and their records to NDJSON files, without a server"""
+    writer = NDJSONWriter(output_dir)
+    started = time.perf_counter()
+    written = 0
+    try:
+        for _ in range(total):
+            written += writer.write_entries(generator.build_patient_entries())
+    finally:
+        writer.close()
+    report_export(written, total, output_dir, started)
+    return written
+
+def main(generator, label):
+    """Generate test data with a server's builders; label names the data, e.g. 'maternal health'"""
+    args = parse_args(f"Generate {label} test data")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.output_dir and not args.longitudinal:
+        print(f"Starting {label} data generation...")
+        if args.engine == "vectorized":
+            export_patients_vectorized(generator, args.patients, args.output_dir, args.seed, args.reference_date)
+        else:
+            export_patients(generator, args.patients, args.output_dir)
+        print(f"{label.capitalize()} data generation complete!")
+        return
+
+    client = FHIRClient(
+        generator.BASE_URL,
+        pool_maxsize=max(args.workers, POOL_MAXSIZE),
+        recorder=LatencyRecorder(),
+        rate_limiter=RateLimiter(args.rate) if args.rate > 0 else None
+    )
+
+    print(f"Starting {label} data generation...")
+
+    if args.longitudinal:
+        generate_longitudinal(generator, client, args.patients, args.schedule, args.output_dir, args.workers)
+    elif args.batch_size > 0:
+        run_workers(
+            lambda start: generate_batch(generator, client, start, args.patients, args.batch_size),
+            range(0, args.patients, args.batch_size),
+            args.workers
+        )
+    else:
+        run_workers(lambda i: generate_patient(generator, client, i, args.patients), range(args.patients), args.workers)
+
+    print(f"{label.capitalize()} data generation complete!")
+    if not args.output_dir:
+        client.recorder.report()
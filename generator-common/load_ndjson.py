@@ -0,0 +1,98 @@
+import argparse
+import glob
+import os
+from fhir_client import FHIRClient, POOL_MAXSIZE, transaction_entry, transaction_bundle
+from load_runner import LatencyRecorder, RateLimiter, run_bounded
+from ndjson_export import read_ndjson
+
+# Referenced resources are loaded first so references resolve on write
+LOAD_ORDER = ["Patient"]
+
+def ndjson_files(input_dir):
+    """List the NDJSON files of a Bulk Data export, Patients first"""
+    paths = sorted(glob.glob(os.path.join(input_dir, "*.ndjson*")))
+    resource_type = lambda path: os.path.basename(path).split(".")[0]
+    return sorted(paths, key=lambda path: (
+        LOAD_ORDER.index(resource_type(path)) if resource_type(path) in LOAD_ORDER else len(LOAD_ORDER)
+    ))
+
+def batches(resources, size):
+    """Group a stream of resources into lists of at most size"""
+    batch = []
+    for resource in resources:
+        batch.append(resource)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def load_batch(client, batch):
+    """PUT a batch of resources, keeping their ids, as one transaction or one request each"""
+    try:
+        if len(batch) == 1:
+            resource = batch[0]
+            response = client.put(f"{resource['resourceType']}/{resource['id']}", resource)
+            ok = response.status_code in (200, 201)
+        else:
+            entries = [transaction_entry(resource, resource_id=resource["id"]) for resource in batch]
+            response = client.transaction(transaction_bundle(entries))
+            ok = response.status_code == 200
+        if not ok:
+            print(f"Failed to load {len(batch)} {batch[0]['resourceType']} resources: {response.text}")
+    except Exception as e:
+        print(f"Error loading {len(batch)} {batch[0]['resourceType']} resources: {str(e)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load a Bulk Data NDJSON export into a FHIR server")
+    parser.add_argument("input_dir", help="Directory holding <ResourceType>.ndjson.gz files")
+    parser.add_argument(
+        "--base-url",
+        default=os.getenv("FHIR_BASE_URL"),
+        required="FHIR_BASE_URL" not in os.environ,
+        help="FHIR server base URL"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("BATCH_SIZE", "100")),
+        help="Resources per transaction Bundle; 1 sends one PUT per resource"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("WORKERS", "4")),
+        help="Maximum number of requests in flight"
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=float(os.getenv("RATE", "0")),
+        help="Target requests per second; 0 means unlimited"
+    )
+    return parser.parse_args()
+
+def main():
+    """Replay an NDJSON export into a FHIR server with bounded concurrency"""
+    args = parse_args()
+    client = FHIRClient(
+        args.base_url,
+        pool_maxsize=max(args.workers, POOL_MAXSIZE),
+        recorder=LatencyRecorder(),
+        rate_limiter=RateLimiter(args.rate) if args.rate > 0 else None
+    )
+    
+    for path in ndjson_files(args.input_dir):
+        print(f"Loading {path}...")
+        # Each file finishes before the next starts, so Patients exist before their Observations
+        run_bounded(
+            lambda batch: load_batch(client, batch),
+            batches(read_ndjson(path), max(args.batch_size, 1)),
+            args.workers
+        )
+    
+    print("Load complete!")
+    client.recorder.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+class RateLimiter:
+    """Spaces requests out evenly so that all workers together stay at a target rate"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+class LatencyRecorder:
+    """Thread-safe collection of request latencies, grouped by resource type"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def record(self, resource_type, seconds, ok=True):
+        with self.lock:
+            self.latencies[resource_type].append(seconds)
+            if not ok:
+                self.failures[resource_type] += 1
+
+    def report(self):
+        """Print request throughput and p50/p95/p99 latency per resource type"""
+        elapsed = time.monotonic() - self.started
+        total = sum(len(values) for values in self.latencies.values())
+        print(f"{total} requests in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s)")
+        print(f"{'resource':<22}{'count':>8}{'failed':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for resource_type, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            print(
+                f"{resource_type:<22}{len(values):>8}{self.failures[resource_type]:>8}"
+                f"{len(values) / elapsed if elapsed else 0:>10.1f}"
+                f"{percentile(values, 50) * 1000:>10.1f}"
+                f"{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}"
+            )
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, int(round(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def run_workers(task, items, workers):
+    """Run task over items on a thread pool, returning once every item is done"""
+    if workers <= 1:
+        for item in items:
+            task(item)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(task, items):
+            pass
+
+def run_bounded(task, items, workers):
+    """
+    Like run_workers, but items may be a lazy iterator: at most 2 * workers
+    items are taken from it ahead of completion, so memory stays bounded.
+    """
+    if workers <= 1:
+        for item in items:
+            task(item)
+        return
+    slots = threading.BoundedSemaphore(2 * workers)
+
+    def release(_):
+        slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            slots.acquire()
+            executor.submit(task, item).add_done_callback(release)
@@ -0,0 +1,88 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+
+def resolve_entries(entries):
+    """
+    Turn transaction entries into standalone resources for export.
+
+    Every resource gets an id (kept if already set), and references to other
+    entries' urn:uuid fullUrls are rewritten to 'Type/id', as the Bulk Data
+    format has no Bundle to resolve them against.
+    """
+    targets = {}
+    for entry in entries:
+        resource = entry["resource"]
+        resource.setdefault("id", str(uuid.uuid4()))
+        targets[entry["fullUrl"]] = f"{resource['resourceType']}/{resource['id']}"
+    resources = [entry["resource"] for entry in entries]
+    for resource in resources:
+        rewrite_references(resource, targets)
+    return resources
+
+def rewrite_references(node, targets):
+    """Recursively replace reference values found in targets"""
+    if isinstance(node, dict):
+        reference = node.get("reference")
+        if isinstance(reference, str) and reference in targets:
+            node["reference"] = targets[reference]
+        for value in node.values():
+            if isinstance(value, (dict, list)):
+                rewrite_references(value, targets)
+    elif isinstance(node, list):
+        for value in node:
+            rewrite_references(value, targets)
+
+class NDJSONWriter:
+    """
+    Streams resources to gzip'd NDJSON files in the FHIR Bulk Data layout:
+    one '<ResourceType>.ndjson.gz' file per resource type, one resource per line.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.files = {}
+        self.raw_files = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, resource):
+        self.write_line(resource["resourceType"], json.dumps(resource, separators=(",", ":")))
+
+    def write_line(self, resource_type, line):
+        """Write a resource that is already serialized to a JSON string"""
+        with self.lock:
+            if resource_type not in self.files:
+                path = os.path.join(self.output_dir, f"{resource_type}.ndjson.gz")
+                # A fixed header mtime keeps output byte-identical between runs
+                self.raw_files[resource_type] = open(path, "wb")
+                self.files[resource_type] = gzip.GzipFile(fileobj=self.raw_files[resource_type], mode="wb", mtime=0)
+                self.counts[resource_type] = 0
+            self.files[resource_type].write(line.encode() + b"\n")
+            self.counts[resource_type] += 1
+
+    def write_entries(self, entries):
+        """Write the resources of a list of transaction entries, returning how many were written"""
+        resources = resolve_entries(entries)
+        for resource in resources:
+            self.write(resource)
+        return len(resources)
+
+    def close(self):
+        with self.lock:
+            for resource_type, handle in self.files.items():
+                handle.close()
+                self.raw_files[resource_type].close()
+            self.files = {}
+            self.raw_files = {}
+
+def read_ndjson(path):
+    """Yield the resources of one gzip'd (or plain) NDJSON file, one at a time"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
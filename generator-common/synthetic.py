@@ -0,0 +1,108 @@
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import names
+
+class NamePool:
+    """
+    A names distribution file loaded once, sampled with the same weighting as
+    names.get_name but for a whole column at a time
+    """
+
+    def __init__(self, path):
+        values, cumulative = [], []
+        with open(path) as name_file:
+            for line in name_file:
+                name, _, cumulative_pct, _ = line.split()
+                values.append(json.dumps(name.capitalize()))
+                cumulative.append(float(cumulative_pct))
+        self.values = np.array(values, dtype=object)
+        self.cumulative = np.array(cumulative)
+
+    def sample(self, rng, n):
+        """Draw n JSON-encoded names"""
+        # names.get_name draws uniformly from [0, 90) over the cumulative percentages
+        index = np.searchsorted(self.cumulative, rng.random(n) * 90, side="right")
+        return self.values[np.minimum(index, len(self.values) - 1)]
+
+class Template:
+    """
+    A resource serialized to JSON once, with named slots that are filled by
+    string formatting. Slots are marked in the source resource with slot("name"),
+    and filled with already JSON-encoded values.
+    """
+
+    def __init__(self, resource):
+        text = json.dumps(resource, separators=(",", ":"))
+        text = text.replace("{", "{{").replace("}", "}}")
+        # Slot markers survive brace escaping since they contain no braces
+        for name in SLOT_NAMES:
+            text = text.replace(f'"{slot(name)}"', "{" + name + "}")
+        self.format = text.format
+
+    def stamp(self, **values):
+        return self.format(**values)
+
+SLOT_NAMES = set()
+
+def slot(name):
+    """Marker for a value filled in when the template is stamped"""
+    SLOT_NAMES.add(name)
+    return f"@@{name}@@"
+
+def identified(resource):
+    """Copy of a resource with an id slot placed right after resourceType"""
+    return {"resourceType": resource["resourceType"], "id": slot("id"), **resource}
+
+def decimals(values, places=1):
+    """Format a column of floats with a fixed number of decimal places"""
+    return [f"{value:.{places}f}" for value in values]
+
+class SyntheticEngine:
+    """
+    Seeded, NumPy-backed source of synthetic data columns.
+
+    Everything is drawn from one numpy Generator and timestamps are relative to
+    a fixed reference time, so a given seed and reference time always produce
+    byte-identical output.
+    """
+
+    name_pools = {}
+
+    def __init__(self, seed=None, reference_time=None):
+        self.rng = np.random.default_rng(seed)
+        self.reference_time = reference_time or datetime.now(timezone.utc).replace(microsecond=0)
+
+    def names(self, kind, n):
+        """Draw n JSON-encoded names; kind is a key of names.FILES"""
+        if kind not in self.name_pools:
+            self.name_pools[kind] = NamePool(names.FILES[kind])
+        return self.name_pools[kind].sample(self.rng, n)
+
+    def integers(self, low, high, n):
+        """n integers in [low, high], inclusive like random.randint"""
+        return self.rng.integers(low, high + 1, n)
+
+    def uniform(self, low, high, n):
+        return self.rng.uniform(low, high, n)
+
+    def choice(self, options, n):
+        return [options[i] for i in self.rng.integers(0, len(options), n)]
+
+    def orderings(self, k, n):
+        """n independent random permutations of range(k), one per row"""
+        return self.rng.permuted(np.tile(np.arange(k), (n, 1)), axis=1)
+
+    def ids(self, n):
+        """n reproducible UUID strings"""
+        raw = self.rng.bytes(16 * n)
+        return [str(uuid.UUID(bytes=raw[i:i + 16], version=4)) for i in range(0, 16 * n, 16)]
+
+    def dates(self, day_offsets, fmt="%Y-%m-%d"):
+        """JSON-encoded dates, each the given number of days after the reference time"""
+        return [json.dumps((self.reference_time + timedelta(days=int(days))).strftime(fmt)) for days in day_offsets]
+
+    def timestamp(self, offset=timedelta()):
+        """JSON-encoded timestamp relative to the reference time"""
+        return json.dumps((self.reference_time + offset).strftime("%Y-%m-%dT%H:%M:%SZ"))
@@ -0,0 +1,34 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+# Prenatal visit schedules, as gestational weeks
+SCHEDULES = {
+    # Every 4 weeks to 28, every 2 weeks to 36, then weekly to delivery
+    "standard": list(range(8, 28, 4)) + list(range(28, 36, 2)) + list(range(36, 41)),
+    "weekly": list(range(4, 41))
+}
+
+def pregnancy_start(reference_time, max_days_ago=300):
+    """
+    Random conception date up to max_days_ago before the reference time, so a
+    cohort mixes ongoing pregnancies with ones that have already delivered
+    """
+    return reference_time - timedelta(days=random.randint(0, max_days_ago), hours=random.randint(0, 23))
+
+def at_week(start, weeks, hours=0):
+    """Point in time a number of gestational weeks (and hours) after conception"""
+    return start + timedelta(weeks=weeks, hours=hours)
+
+def fhir_datetime(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def visits(start, schedule, reference_time):
+    """Yield (gestational week, visit time) for each scheduled visit that has happened by the reference time"""
+    for week in SCHEDULES[schedule]:
+        moment = at_week(start, week, hours=random.randint(8, 17))
+        if moment > reference_time:
+            return
+        yield week, moment
+
+def now():
+    return datetime.now(timezone.utc).replace(microsecond=0)
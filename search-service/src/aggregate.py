@@ -0,0 +1,123 @@
+import asyncio
+import math
+import httpx
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from config import AGGREGATE_PAGE_SIZE
+from federation import build_search_url, next_link
+from health import server_health
+from pagination import fetch_page, page_query
+from registry import server_url
+
+# Group of resources that have no value at the grouped path
+MISSING = "(missing)"
+
+def path_values(value: Any, path: List[str]) -> Iterator[Any]:
+    """Every value at a dotted path, following each item of the lists along the way"""
+    if isinstance(value, list):
+        for item in value:
+            yield from path_values(item, path)
+    elif not path:
+        if value is not None:
+            yield value
+    elif isinstance(value, dict):
+        yield from path_values(value.get(path[0]), path[1:])
+
+def group_label(value: Any, bucket: Optional[float]) -> str:
+    """
+    The group a value falls in: codes by display (or code), quantities by
+    value, references by reference. With a bucket width, numbers are grouped
+    into ranges such as '8-12'.
+    """
+    if isinstance(value, dict):
+        coding = value.get('coding')
+        if coding:
+            value = coding[0]
+        value = next((value[key] for key in ('display', 'value', 'code', 'reference', 'text') if key in value), None)
+        if value is None:
+            return MISSING
+    if bucket and isinstance(value, (int, float)) and not isinstance(value, bool):
+        low = math.floor(value / bucket) * bucket
+        return f"{low:g}-{low + bucket:g}"
+    return str(value)
+
+def resource_groups(resource: Dict[str, Any], path: List[str], bucket: Optional[float]) -> List[str]:
+    """The groups a resource counts towards, each once"""
+    labels = {group_label(value, bucket) for value in path_values(resource, path)}
+    return sorted(labels) if labels else [MISSING]
+
+async def count_on(client: httpx.AsyncClient, server: Dict[str, Any], resource_type: str,
+                   search_params: Dict[str, str]) -> Optional[int]:
+    """Number of matches on one server, by _summary=count; None if the server failed"""
+    url = build_search_url(server, resource_type, {**search_params, '_summary': 'count'})
+    bundle = await fetch_page(client, server, url)
+    return None if bundle is None else bundle.get('total', 0)
+
+async def group_on(client: httpx.AsyncClient, server: Dict[str, Any], resource_type: str,
+                   search_params: Dict[str, str], path: List[str],
+                   bucket: Optional[float]) -> Optional[Tuple[int, Counter]]:
+    """
+    Number of matches on one server and their counts by group, scanning
+    every page with _elements trimmed to the grouped element; None if the
+    server failed. A resource with several values counts in each group.
+    """
+    url = build_search_url(server, resource_type, {
+        **search_params, '_elements': path[0], '_count': str(AGGREGATE_PAGE_SIZE)
+    })
+    matches = 0
+    groups: Counter = Counter()
+    while url:
+        bundle = await fetch_page(client, server, url)
+        if bundle is None:
+            return None
+        for entry in bundle.get('entry', []):
+            resource = entry.get('resource')
+            if resource and entry.get('search', {}).get('mode', 'match') == 'match':
+                matches += 1
+                groups.update(resource_groups(resource, path, bucket))
+        upstream_next = next_link(bundle)
+        url = f"{server_url(server)}?{page_query(upstream_next)}" if upstream_next else None
+    return matches, groups
+
+async def aggregate(client: httpx.AsyncClient, servers: List[Dict[str, Any]], resource_type: str,
+                    search_params: Dict[str, str], group: Optional[str] = None,
+                    bucket: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Count a search's matches on every server concurrently, in total and per
+    server, and with a group path also by the value found there. Servers
+    that are down or fail are listed as unavailable.
+    """
+    available = server_health.route(servers)
+    unavailable = [server['name'] for server in servers if server not in available]
+
+    if group:
+        path = group.split('.')
+        results: List[Any] = await asyncio.gather(*(
+            group_on(client, server, resource_type, search_params, path, bucket) for server in available
+        ))
+    else:
+        results = await asyncio.gather(*(
+            count_on(client, server, resource_type, search_params) for server in available
+        ))
+
+    counts: Dict[str, int] = {}
+    groups: Counter = Counter()
+    for server, result in zip(available, results):
+        if result is None:
+            unavailable.append(server['name'])
+        elif group:
+            counts[server['name']] = result[0]
+            groups.update(result[1])
+        else:
+            counts[server['name']] = result
+
+    summary: Dict[str, Any] = {
+        "resource_type": resource_type,
+        "total": sum(counts.values()),
+        "servers": counts,
+        "unavailable": unavailable
+    }
+    if group:
+        summary["group"] = group
+        summary["groups"] = dict(groups.most_common())
+    return summary
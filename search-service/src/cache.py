@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+CacheKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+def cache_key(resource_type: str, search_params: Dict[str, str]) -> CacheKey:
+    """Normalize a search into a hashable key, independent of parameter order"""
+    return resource_type, tuple(sorted(search_params.items()))
+
+def parse_ttls(spec: str) -> Dict[str, float]:
+    """Parse a per-resource-type TTL spec such as 'Patient=300,CarePlan=120'"""
+    ttls = {}
+    for item in spec.split(','):
+        if '=' in item:
+            resource_type, seconds = item.split('=', 1)
+            ttls[resource_type.strip()] = float(seconds)
+    return ttls
+
+class CacheEntry:
+    __slots__ = ('value', 'expires_at')
+
+    def __init__(self, value: Dict[Any, Any], expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self) -> bool:
+        return time.monotonic() < self.expires_at
+
+class ResponseCache:
+    """
+    In-process LRU cache of search results with a TTL per resource type.
+
+    Expired entries are kept until evicted so callers can revalidate them
+    against the owning server instead of re-running the search.
+    """
+
+    def __init__(self, max_entries: int, default_ttl: float, ttls: Optional[Dict[str, float]] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    def ttl(self, resource_type: str) -> float:
+        return self.ttls.get(resource_type, self.default_ttl)
+
+    def get(self, resource_type: str, search_params: Dict[str, str]) -> Optional[Dict[Any, Any]]:
+        """Return a fresh cached result, counting the lookup as a hit or miss"""
+        key = cache_key(resource_type, search_params)
+        entry = self.entries.get(key)
+        if entry is not None and entry.fresh:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+        self.misses += 1
+        return None
+
+    def get_stale(self, resource_type: str, search_params: Dict[str, str]) -> Optional[Dict[Any, Any]]:
+        """Return a cached result even if it has expired, for revalidation"""
+        entry = self.entries.get(cache_key(resource_type, search_params))
+        return entry.value if entry is not None else None
+
+    def put(self, resource_type: str, search_params: Dict[str, str], value: Dict[Any, Any]) -> None:
+        ttl = self.ttl(resource_type)
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        key = cache_key(resource_type, search_params)
+        self.entries[key] = CacheEntry(value, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def revalidated(self, resource_type: str, search_params: Dict[str, str]) -> None:
+        """Mark an expired entry as confirmed current by its owning server"""
+        entry = self.entries.get(cache_key(resource_type, search_params))
+        if entry is not None:
+            entry.expires_at = time.monotonic() + self.ttl(resource_type)
+            self.revalidations += 1
+
+    def pop(self, resource_type: str, search_params: Dict[str, str]) -> None:
+        self.entries.pop(cache_key(resource_type, search_params), None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,148 @@
+import asyncio
+import httpx
+import orjson
+from typing import Any, Callable, Dict, List, Optional
+from health import server_timeout
+from registry import registry, server_url
+
+# HAPI annotates each resource in its CapabilityStatement with the number stored
+RESOURCE_COUNT_EXTENSION = "http://hl7api.sourceforge.net/hapi-fhir/res/extdefs.html#resourceCount"
+
+def capability_types(capability: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    """Resource types a CapabilityStatement supports, with their counts where given"""
+    types = {}
+    for rest in capability.get('rest', []):
+        if rest.get('mode', 'server') != 'server':
+            continue
+        for resource in rest.get('resource', []):
+            count = next((
+                int(extension['valueDecimal'])
+                for extension in resource.get('extension', [])
+                if extension.get('url') == RESOURCE_COUNT_EXTENSION and 'valueDecimal' in extension
+            ), None)
+            types[resource['type']] = count
+    return types
+
+def parameter_counts(parameters: Dict[str, Any]) -> Dict[str, int]:
+    """Counts from a $get-resource-counts Parameters resource"""
+    return {
+        parameter['name']: int(parameter['valueInteger'])
+        for parameter in parameters.get('parameter', [])
+        if 'valueInteger' in parameter
+    }
+
+class RoutingTable:
+    """
+    Which resource types each server can hold, learned from its
+    CapabilityStatement, and how many of each it holds. Searches for a type
+    go only to servers that support it. Servers not yet (or never) refreshed
+    are always routed to.
+
+    Counts come from HAPI's resourceCount extension on the CapabilityStatement,
+    or else its $get-resource-counts operation. Both leave out types with no
+    resources, so once either answered, a missing count means zero. Counts
+    are only a hint: they are cached by HAPI and refreshed here every
+    CAPABILITY_REFRESH_INTERVAL, so a server that had none of a type may have
+    some by now. Such servers are not skipped outright: a priority search asks
+    them in a second phase, only when the others have no matches.
+    """
+
+    def __init__(self):
+        self.types: Dict[str, Dict[str, int]] = {}
+        self.counted: Dict[str, bool] = {}
+        self.skipped: Dict[str, int] = {}
+
+    def may_hold(self, name: str, resource_type: str) -> bool:
+        types = self.types.get(name)
+        return types is None or resource_type in types
+
+    def known_empty(self, name: str, resource_type: str) -> bool:
+        """Whether the server's last counts had none of the type"""
+        return bool(self.counted.get(name)) and self.types.get(name, {}).get(resource_type) == 0
+
+    def update(self, name: str, types: Dict[str, Optional[int]], counts: Optional[Dict[str, int]]) -> None:
+        """
+        Record the types a server supports. counts, from $get-resource-counts,
+        stand in when the CapabilityStatement carried no counts.
+        """
+        counted = counts is not None or any(count is not None for count in types.values())
+        counts = counts or {}
+        self.types[name] = {
+            resource_type: count if count is not None else counts.get(resource_type, 0)
+            for resource_type, count in types.items()
+        }
+        self.counted[name] = counted
+
+    def servers(self, resource_type: str) -> List[Dict[str, Any]]:
+        """
+        The registry's servers for a resource type (honouring affinities) that
+        support it, in priority order except that servers last counted as
+        having none of it come after the rest
+        """
+        servers = []
+        for server in registry.servers(resource_type):
+            if self.may_hold(server['name'], resource_type):
+                servers.append(server)
+            else:
+                self.skip([server])
+        # A stable sort keeps priority order within each group
+        return sorted(servers, key=lambda server: self.known_empty(server['name'], resource_type))
+
+    def phases(self, resource_type: str) -> List[List[Dict[str, Any]]]:
+        """
+        servers(), split into those a priority search asks first and those
+        last counted as having none of the type, asked only if the first
+        have no matches
+        """
+        servers = self.servers(resource_type)
+        empty = [server for server in servers if self.known_empty(server['name'], resource_type)]
+        return [[server for server in servers if server not in empty], empty]
+
+    def skip(self, servers: List[Dict[str, Any]]) -> None:
+        """Count a search that did not need to ask the given servers"""
+        for server in servers:
+            self.skipped[server['name']] = self.skipped.get(server['name'], 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "resource_types": len(types),
+                "non_empty": sorted(t for t, count in types.items() if count) if self.counted.get(name) else None,
+                "skipped_searches": self.skipped.get(name, 0)
+            }
+            for name, types in self.types.items()
+        }
+
+routing_table = RoutingTable()
+
+async def refresh(client: httpx.AsyncClient, server: Dict[str, Any]) -> bool:
+    """Re-read a server's CapabilityStatement and resource counts into the routing table"""
+    base_url = server_url(server)
+    try:
+        response = await client.get(f"{base_url}/metadata", timeout=server_timeout(server))
+        if response.status_code != 200:
+            return False
+        capability = orjson.loads(response.content)
+        types = capability_types(capability)
+        if capability.get('resourceType') != 'CapabilityStatement' or not types:
+            return False
+
+        counts = None
+        if all(count is None for count in types.values()):
+            response = await client.get(f"{base_url}/$get-resource-counts", timeout=server_timeout(server))
+            if response.status_code == 200:
+                counts = parameter_counts(orjson.loads(response.content))
+    except (httpx.HTTPError, orjson.JSONDecodeError) as e:
+        print(f"Error reading capabilities of {server['name']}: {str(e)}")
+        return False
+
+    routing_table.update(server['name'], types, counts)
+    return True
+
+async def refresh_periodically(client: httpx.AsyncClient, servers: Callable[[], List[Dict[str, Any]]], interval: float) -> None:
+    """Background task: refresh every server's capabilities each interval seconds (0 refreshes once)"""
+    while True:
+        await asyncio.gather(*(refresh(client, server) for server in servers()))
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
@@ -1,3 +1,6 @@
+import os
+
+# Built-in upstream servers, used when there is no registry file
 FHIR_SERVERS = [
     {
         "name": "maternal",
@@ -14,4 +17,89 @@ FHIR_SERVERS = [
         "url": "http://obstetric-fhir:8080/fhir",
         "priority": 3
     }
-]
\ No newline at end of file
+]
+
+# Server registry file (see servers.yaml), checked for changes every
+# REGISTRY_RELOAD_INTERVAL seconds (0 disables reloading)
+SERVERS_FILE = os.getenv("FHIR_SERVERS_FILE", os.path.join(os.path.dirname(__file__), "servers.yaml"))
+REGISTRY_RELOAD_INTERVAL = float(os.getenv("REGISTRY_RELOAD_INTERVAL", "5"))
+
+# Connection pool and retry settings for upstream FHIR requests. Each server
+# gets a pool of at most UPSTREAM_POOL_SIZE connections (also its limit on
+# concurrent requests), of which UPSTREAM_MAX_KEEPALIVE are kept open when idle.
+# Named apart from the data generators' FHIR_* settings, which mean other things
+POOL_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_SIZE", "20"))
+POOL_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "5"))
+BACKOFF_FACTOR = float(os.getenv("UPSTREAM_BACKOFF_FACTOR", "0.5"))
+MAX_RETRY_DELAY = float(os.getenv("UPSTREAM_MAX_RETRY_DELAY", "5"))
+RETRY_STATUSES = (429, 503)
+
+# Response cache: bounded LRU with a default TTL and per-resource-type overrides
+# (CACHE_TTLS="Patient=300,CarePlan=120"); a TTL of 0 disables caching for a type
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "30"))
+CACHE_TTLS = os.getenv("CACHE_TTLS", "Patient=300,CarePlan=300")
+
+# Resource location index: 'ResourceType/id' -> owning server, fed from search
+# results and a background _history scan every LOCATION_SCAN_INTERVAL seconds
+# (0 scans once at startup, negative disables the scan)
+LOCATION_INDEX_MAX_ENTRIES = int(os.getenv("LOCATION_INDEX_MAX_ENTRIES", "100000"))
+LOCATION_SCAN_INTERVAL = float(os.getenv("LOCATION_SCAN_INTERVAL", "300"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "500"))
+
+# Priority searches asking for at least STREAM_MIN_COUNT results per page (_count)
+# are streamed through from the winning server instead of being parsed and cached
+# (0 streams every search, negative never streams)
+STREAM_MIN_COUNT = int(os.getenv("STREAM_MIN_COUNT", "100"))
+
+# Upstream health: per-server request timeouts (FHIR_TIMEOUTS="fetal=3" overrides
+# FHIR_TIMEOUT), a circuit breaker per server over its last BREAKER_WINDOW requests,
+# and a /metadata probe every HEALTH_PROBE_INTERVAL seconds (0 disables probing)
+UPSTREAM_TIMEOUT = float(os.getenv("FHIR_TIMEOUT", "10"))
+UPSTREAM_TIMEOUTS = os.getenv("FHIR_TIMEOUTS", "")
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_SLOW_SECONDS = float(os.getenv("BREAKER_SLOW_SECONDS", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))
+
+# Tracing: TRACE_EXPORTER=file appends spans as JSON lines to TRACE_FILE,
+# TRACE_EXPORTER=memory keeps them in process (tests); unset leaves tracing off
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+# Capability-aware routing: each server's CapabilityStatement and resource
+# counts are re-read every CAPABILITY_REFRESH_INTERVAL seconds (0 reads them
+# once at startup, negative disables capability routing)
+CAPABILITY_REFRESH_INTERVAL = float(os.getenv("CAPABILITY_REFRESH_INTERVAL", "300"))
+
+# Batch endpoint: at most BATCH_MAX_ENTRIES entries per Bundle, of which at most
+# BATCH_CONCURRENCY are answered at the same time
+BATCH_MAX_ENTRIES = int(os.getenv("BATCH_MAX_ENTRIES", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "10"))
+
+# Federated _include/_revinclude: referenced resources are fetched with _id
+# (or reference) searches of at most INCLUDE_BATCH_SIZE values each, and at most
+# INCLUDE_MAX_ENTRIES are added to a page (HAPI's own default limit is 1000)
+INCLUDE_BATCH_SIZE = int(os.getenv("INCLUDE_BATCH_SIZE", "50"))
+INCLUDE_MAX_ENTRIES = int(os.getenv("INCLUDE_MAX_ENTRIES", "1000"))
+
+# Page size of a merge-mode _sort search that gives no _count (HAPI's own default)
+SORT_DEFAULT_COUNT = int(os.getenv("SORT_DEFAULT_COUNT", "20"))
+
+# Aggregates: group-by scans read AGGREGATE_PAGE_SIZE resources per upstream page,
+# and results are cached for AGGREGATE_CACHE_TTL seconds (0 disables the cache)
+AGGREGATE_PAGE_SIZE = int(os.getenv("AGGREGATE_PAGE_SIZE", "500"))
+AGGREGATE_CACHE_TTL = float(os.getenv("AGGREGATE_CACHE_TTL", "60"))
+AGGREGATE_CACHE_MAX_ENTRIES = int(os.getenv("AGGREGATE_CACHE_MAX_ENTRIES", "1000"))
+
+# Materialized view of key prenatal facts in SQLite, kept current by polling each
+# server's _history?_since= every VIEW_SYNC_INTERVAL seconds (0 syncs once at
+# startup, negative disables the view's sync); the per-server cursor lives in VIEW_DB.
+# Off by default: the first sync walks every server's full history, on top of
+# the location index's own scan
+VIEW_DB = os.getenv("VIEW_DB", os.path.join(os.path.dirname(__file__), "prenatal_view.db"))
+VIEW_SYNC_INTERVAL = float(os.getenv("VIEW_SYNC_INTERVAL", "-1"))
@@ -0,0 +1,100 @@
+import asyncio
+import httpx
+import orjson
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+from opentelemetry import trace
+from opentelemetry.trace import Span
+from capabilities import routing_table
+from federation import MERGE_QUEUE_SIZE, stream_server_entries, queued_entries
+from health import server_health, outcome_entry
+from includes import Target, absolute_reference, entry_target, references_on
+
+# Clinical records gathered for a patient and their linked fetal patients, all searchable by subject
+EVERYTHING_TYPES = ("Observation", "DiagnosticReport", "CarePlan", "RiskAssessment")
+
+def link_references(patient: Target) -> str:
+    """
+    Every form a fetal Patient's link.other may take for the given Patient:
+    relative, as create_patient(maternal_id) writes it, or absolute
+    """
+    references = [f"Patient/{patient[2]}", absolute_reference(patient)]
+    return ",".join(reference for reference in references if reference)
+
+async def everything_bundle(client: httpx.AsyncClient, patient: Dict[str, Any],
+                            span: Optional[Span] = None) -> AsyncIterator[bytes]:
+    """
+    Stream one searchset Bundle with a Patient (the tagged entry of a read),
+    the fetal Patients linked to it, and the EVERYTHING_TYPES records of all
+    of them from every server that may hold them.
+
+    The Patient's own records are searched for while the linked Patients are
+    still being looked up; the fetal records follow once those are known.
+    Entries are written out as they arrive and de-duplicated by fullUrl, and
+    an OperationOutcome entry at the end lists any skipped or failed server.
+    span, if given, parents the upstream calls and is ended with the stream.
+    """
+    span = span or trace.INVALID_SPAN
+    failed: List[str] = []
+    records: asyncio.Queue = asyncio.Queue(maxsize=MERGE_QUEUE_SIZE)
+    producers: List[asyncio.Task] = []
+
+    def search(queue: asyncio.Queue, resource_type: str,
+               params: Callable[[Dict[str, Any]], Dict[str, str]]) -> int:
+        """Start a search on every available server that may hold the type; returns how many were started"""
+        servers = routing_table.servers(resource_type)
+        available = server_health.route(servers)
+        failed.extend(server['name'] for server in servers if server not in available)
+        # Tasks copy the current context, so the upstream spans nest under span
+        with trace.use_span(span, end_on_exit=False):
+            for server in available:
+                producers.append(asyncio.create_task(stream_server_entries(
+                    client, server, resource_type, params(server), queue, failed
+                )))
+        return len(available)
+
+    def search_records(patients: List[Target]) -> int:
+        return sum(
+            search(records, resource_type, lambda server: {'subject': references_on(server, patients)})
+            for resource_type in EVERYTHING_TYPES
+        )
+
+    try:
+        yield b'{"resourceType":"Bundle","type":"searchset","entry":['
+        yield orjson.dumps(patient)
+        seen = {patient.get('fullUrl')}
+        total = 1
+
+        maternal = entry_target(patient)
+        searches = search_records([maternal])
+
+        links: asyncio.Queue = asyncio.Queue(maxsize=MERGE_QUEUE_SIZE)
+        lookups = search(links, 'Patient', lambda server: {'link': link_references(maternal)})
+        fetal = []
+        async for entry in queued_entries(links, lookups):
+            if entry.get('resource', {}).get('resourceType') != 'Patient' or entry.get('fullUrl') in seen:
+                continue
+            seen.add(entry.get('fullUrl'))
+            fetal.append(entry_target(entry))
+            yield b',' + orjson.dumps(entry)
+            total += 1
+
+        if fetal:
+            searches += search_records(fetal)
+        async for entry in queued_entries(records, searches):
+            full_url = entry.get('fullUrl')
+            if full_url:
+                if full_url in seen:
+                    continue
+                seen.add(full_url)
+            yield b',' + orjson.dumps(entry)
+            total += 1
+
+        outcome = outcome_entry(sorted(set(failed)))
+        if outcome:
+            yield b',' + orjson.dumps(outcome)
+        yield f'],"total":{total}}}'.encode()
+        span.set_attribute("fhir.entry_count", total)
+    finally:
+        for producer in producers:
+            producer.cancel()
+        span.end()
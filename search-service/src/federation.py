@@ -0,0 +1,124 @@
+import asyncio
+import httpx
+import orjson
+from typing import AsyncIterator, Dict, Any, List, Optional
+from urllib.parse import urlencode
+from opentelemetry import trace
+from opentelemetry.trace import Span
+from health import server_health, get_from, outcome_entry
+from tracing import upstream_span, record_entries
+from location_index import location_index
+from registry import server_url
+
+# Maximum number of entries buffered between the upstream readers and the client
+MERGE_QUEUE_SIZE = 500
+
+def build_search_url(server: Dict[str, Any], resource_type: str, search_params: Dict[str, str]) -> str:
+    """Construct the search URL for a server with the given parameters"""
+    base_url = f"{server_url(server)}/{resource_type}"
+    if search_params:
+        return f"{base_url}?{urlencode(search_params)}"
+    return base_url
+
+def tag_source(entries: List[Dict[str, Any]], server_name: str) -> None:
+    """
+    Add source server information to each entry's resource meta, and remember
+    the server in the location index
+    """
+    for entry in entries:
+        if 'resource' in entry:
+            entry['resource']['meta'] = entry['resource'].get('meta', {})
+            entry['resource']['meta']['source'] = server_name
+    location_index.record_entries(entries, server_name)
+
+def next_link(bundle: Dict[str, Any]) -> Optional[str]:
+    """Return the URL of the next page of a Bundle, if there is one"""
+    for link in bundle.get('link', []):
+        if link.get('relation') == 'next':
+            return link.get('url')
+    return None
+
+async def stream_server_entries(client: httpx.AsyncClient, server: Dict[str, Any], resource_type: str,
+                                search_params: Dict[str, str], queue: asyncio.Queue, failed: List[str]) -> None:
+    """
+    Walk every page of a server's search results, pushing tagged entries onto the queue.
+    A None sentinel is always pushed once the server is exhausted or fails; a
+    server that fails is added to failed.
+    """
+    url = build_search_url(server, resource_type, search_params)
+    try:
+        while url:
+            with upstream_span(server, url):
+                response = await get_from(client, server, url)
+                if response.status_code != 200:
+                    failed.append(server['name'])
+                    break
+                bundle = orjson.loads(response.content)
+                entries = bundle.get('entry', [])
+                record_entries(entries)
+            tag_source(entries, server['name'])
+            for entry in entries:
+                await queue.put(entry)
+            url = next_link(bundle)
+    except httpx.HTTPError as e:
+        print(f"Error querying {server['name']}: {str(e)}")
+        failed.append(server['name'])
+    finally:
+        await queue.put(None)
+
+async def queued_entries(queue: asyncio.Queue, producers: int) -> AsyncIterator[Dict[str, Any]]:
+    """Entries from the queue until each of the given number of producers has pushed its None sentinel"""
+    finished = 0
+    while finished < producers:
+        entry = await queue.get()
+        if entry is None:
+            finished += 1
+            continue
+        yield entry
+
+async def merged_bundle(client: httpx.AsyncClient, servers: List[Dict[str, Any]], resource_type: str,
+                        search_params: Dict[str, str], span: Optional[Span] = None) -> AsyncIterator[bytes]:
+    """
+    Stream a single searchset Bundle combining the results of every server.
+
+    Entries are written out as soon as any server produces them and are
+    de-duplicated by fullUrl. The combined total is only known at the end,
+    so it is emitted after the entry array. Servers that are down are skipped,
+    and an OperationOutcome entry at the end lists any skipped or failed server.
+    The body is produced after the endpoint has returned, so its span is
+    passed in; it parents the upstream calls and is ended with the stream.
+    """
+    available = server_health.route(servers)
+    failed = [server['name'] for server in servers if server not in available]
+    queue: asyncio.Queue = asyncio.Queue(maxsize=MERGE_QUEUE_SIZE)
+    span = span or trace.INVALID_SPAN
+    # Tasks copy the current context, so the upstream spans nest under span
+    with trace.use_span(span, end_on_exit=False):
+        producers = [
+            asyncio.create_task(stream_server_entries(client, server, resource_type, search_params, queue, failed))
+            for server in available
+        ]
+
+    try:
+        yield b'{"resourceType":"Bundle","type":"searchset","entry":['
+        seen = set()
+        total = 0
+        async for entry in queued_entries(queue, len(producers)):
+            full_url = entry.get('fullUrl')
+            if full_url:
+                if full_url in seen:
+                    continue
+                seen.add(full_url)
+            chunk = orjson.dumps(entry)
+            yield chunk if total == 0 else b',' + chunk
+            total += 1
+        outcome = outcome_entry(failed)
+        if outcome:
+            chunk = orjson.dumps(outcome)
+            yield chunk if total == 0 else b',' + chunk
+        yield f'],"total":{total}}}'.encode()
+        span.set_attribute("fhir.entry_count", total)
+    finally:
+        for producer in producers:
+            producer.cancel()
+        span.end()
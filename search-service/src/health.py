@@ -0,0 +1,268 @@
+import asyncio
+import time
+import httpx
+from collections import deque
+from typing import Awaitable, Callable, Dict, Any, List, Optional, Tuple
+from config import (
+    POOL_MAX_CONNECTIONS, UPSTREAM_TIMEOUT, UPSTREAM_TIMEOUTS, BREAKER_WINDOW, BREAKER_MIN_REQUESTS,
+    BREAKER_ERROR_RATE, BREAKER_SLOW_SECONDS, BREAKER_OPEN_SECONDS
+)
+from cache import parse_ttls
+from registry import server_url
+from http_client import send_with_retry
+from tracing import trace_headers, record_response
+from metrics import UPSTREAM_REQUESTS, UPSTREAM_LATENCY, UPSTREAM_IN_FLIGHT, UPSTREAM_BYTES, UPSTREAM_ERRORS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one upstream server.
+
+    Closed: requests flow and their outcomes are kept in a sliding window.
+    Once enough of the window has failed (errors, 5xx or responses slower
+    than BREAKER_SLOW_SECONDS) the breaker opens and the server is skipped.
+    After BREAKER_OPEN_SECONDS one trial request is let through (half-open):
+    success closes the breaker again, failure re-opens it. The trial is
+    claimed by the request itself as it is sent (see timed), so a request
+    that is planned but never sent cannot hold it.
+    """
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_requests: int = BREAKER_MIN_REQUESTS,
+                 error_rate: float = BREAKER_ERROR_RATE, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.outcomes: deque = deque(maxlen=window)
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trips = 0
+
+    def cooled_down(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.open_seconds
+
+    def ready(self) -> bool:
+        """Whether allow() would let a request through now, without claiming the half-open trial"""
+        if self.state == OPEN:
+            return self.cooled_down()
+        if self.state == HALF_OPEN:
+            return not self.trial_in_flight
+        return True
+
+    def allow(self) -> bool:
+        """Whether a request may be sent now. In half-open state this claims the single trial."""
+        if self.state == OPEN and self.cooled_down():
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+        return self.state == CLOSED
+
+    def record(self, ok: bool) -> None:
+        if self.state == HALF_OPEN:
+            self.trial_in_flight = False
+            if ok:
+                self.close()
+            else:
+                self.open()
+            return
+        self.outcomes.append(ok)
+        failures = self.outcomes.count(False)
+        if len(self.outcomes) >= self.min_requests and failures / len(self.outcomes) >= self.error_rate:
+            self.open()
+
+    def release(self) -> None:
+        """Give back a half-open trial whose request was cancelled before it finished"""
+        self.trial_in_flight = False
+
+    def open(self) -> None:
+        if self.state != OPEN:
+            self.trips += 1
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+
+    def close(self) -> None:
+        self.state = CLOSED
+        self.outcomes.clear()
+
+class ServerHealth:
+    """
+    Health of every upstream server: a circuit breaker fed by real traffic,
+    plus the result of the last /metadata probe. A server is routed to only
+    while its breaker allows it and its last probe succeeded.
+    """
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.probes: Dict[str, bool] = {}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker()
+        return self.breakers[name]
+
+    def available(self, name: str) -> bool:
+        """Whether to send a request to the server now; timed() claims a half-open trial when it is sent"""
+        return self.probes.get(name, True) and self.breaker(name).ready()
+
+    def down(self, name: str) -> bool:
+        """Whether the server is currently being skipped, without claiming anything"""
+        breaker = self.breaker(name)
+        return not self.probes.get(name, True) or (breaker.state == OPEN and not breaker.cooled_down())
+
+    def route(self, servers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The servers that requests may be sent to right now, in the given order"""
+        return [server for server in servers if self.available(server['name'])]
+
+    def record(self, name: str, ok: bool, seconds: float) -> None:
+        self.breaker(name).record(ok and seconds <= BREAKER_SLOW_SECONDS)
+
+    def probed(self, name: str, ok: bool) -> None:
+        self.probes[name] = ok
+        # A server that answers its probe again gets a trial request straight away
+        breaker = self.breaker(name)
+        if ok and breaker.state == OPEN:
+            breaker.opened_at -= breaker.open_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                "state": breaker.state,
+                "probe_ok": self.probes.get(name),
+                "recent_requests": len(breaker.outcomes),
+                "recent_failures": breaker.outcomes.count(False),
+                "trips": breaker.trips
+            }
+            for name, breaker in self.breakers.items()
+        }
+
+server_health = ServerHealth()
+
+class ServerSkipped(httpx.TransportError):
+    """A request not sent because the server's circuit breaker would not let it through"""
+
+server_timeouts = parse_ttls(UPSTREAM_TIMEOUTS)
+
+def server_timeout(server: Dict[str, Any]) -> float:
+    """Request timeout for a server: its registry timeout, its FHIR_TIMEOUTS override, or FHIR_TIMEOUT"""
+    return server.get('timeout', server_timeouts.get(server['name'], UPSTREAM_TIMEOUT))
+
+# Concurrency limit per server and pool size, so a resized server gets a new limit
+server_slots: Dict[Tuple[str, int], asyncio.Semaphore] = {}
+
+def slots(server: Dict[str, Any]) -> asyncio.Semaphore:
+    """Semaphore bounding concurrent requests to a server to its pool_size"""
+    key = (server['name'], server.get('pool_size', POOL_MAX_CONNECTIONS))
+    if key not in server_slots:
+        server_slots[key] = asyncio.Semaphore(key[1])
+    return server_slots[key]
+
+async def timed(server: Dict[str, Any], send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+    """
+    Send a request to a server, report the outcome to its circuit breaker and
+    record it in the upstream metrics. Transport errors, timeouts and 5xx
+    answers count as failures. Raises ServerSkipped if the breaker is open,
+    or half-open with its trial taken by another request.
+    """
+    name = server['name']
+    if not server_health.breaker(name).allow():
+        raise ServerSkipped(f"Circuit breaker for {name} is {server_health.breaker(name).state}")
+    started = time.monotonic()
+    UPSTREAM_IN_FLIGHT.labels(name).inc()
+    try:
+        async with slots(server):
+            response = await send()
+    except httpx.HTTPError as e:
+        elapsed = time.monotonic() - started
+        server_health.record(name, False, elapsed)
+        UPSTREAM_LATENCY.labels(name).observe(elapsed)
+        UPSTREAM_ERRORS.labels(name, "timeout" if isinstance(e, httpx.TimeoutException) else "transport").inc()
+        raise
+    except asyncio.CancelledError:
+        server_health.breaker(name).release()
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.labels(name).dec()
+
+    elapsed = time.monotonic() - started
+    server_health.record(name, response.status_code < 500, elapsed)
+    UPSTREAM_LATENCY.labels(name).observe(elapsed)
+    UPSTREAM_REQUESTS.labels(name, str(response.status_code)).inc()
+    if response.status_code >= 500:
+        UPSTREAM_ERRORS.labels(name, "status").inc()
+    record_response(response)
+    # Streamed bodies are counted once they have been read (see streaming.passthrough)
+    if response.is_closed:
+        UPSTREAM_BYTES.labels(name).inc(response.num_bytes_downloaded)
+    return response
+
+async def get_from(client: httpx.AsyncClient, server: Dict[str, Any], url: str,
+                   headers: Optional[Dict[str, str]] = None, **kwargs) -> httpx.Response:
+    """
+    GET a URL from a server with its timeout and the current trace context.
+    Each attempt is timed and reported to the circuit breaker on its own;
+    the backoff between 429/503 retries holds no slot and is not timed.
+    """
+    headers, timeout = trace_headers(headers), server_timeout(server)
+    return await send_with_retry(lambda: timed(server, lambda: client.get(
+        url, headers=headers, timeout=timeout, **kwargs
+    )), timeout)
+
+async def stream_from(client: httpx.AsyncClient, server: Dict[str, Any], url: str,
+                      headers: Optional[Dict[str, str]] = None, **kwargs) -> httpx.Response:
+    """
+    Like get_from, but return as soon as the response headers arrive so the
+    body can be read incrementally. The caller must close the response.
+    """
+    headers, timeout = trace_headers(headers), server_timeout(server)
+    return await send_with_retry(lambda: timed(server, lambda: client.send(
+        client.build_request("GET", url, headers=headers, timeout=timeout, **kwargs), stream=True
+    )), timeout)
+
+async def probe(client: httpx.AsyncClient, server: Dict[str, Any]) -> bool:
+    """Check a server's /metadata (CapabilityStatement) endpoint"""
+    try:
+        response = await client.get(f"{server_url(server)}/metadata", timeout=server_timeout(server))
+        ok = response.status_code == 200
+    except httpx.HTTPError as e:
+        print(f"Health probe of {server['name']} failed: {str(e)}")
+        ok = False
+    server_health.probed(server['name'], ok)
+    return ok
+
+async def probe_periodically(client: httpx.AsyncClient, servers: Callable[[], List[Dict[str, Any]]], interval: float) -> None:
+    """Background task: probe every server returned by servers() each interval seconds"""
+    while True:
+        await asyncio.gather(*(probe(client, server) for server in servers()))
+        await asyncio.sleep(interval)
+
+def is_partial(bundle: Dict[str, Any]) -> bool:
+    """Whether a Bundle carries an outcome entry from outcome_entry"""
+    return any(entry.get('search', {}).get('mode') == 'outcome' for entry in bundle.get('entry', []))
+
+def outcome_entry(unavailable: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    An OperationOutcome entry (search mode 'outcome') telling the client that
+    the listed servers were skipped or failed, so the results may be partial
+    """
+    if not unavailable:
+        return None
+    return {
+        "resource": {
+            "resourceType": "OperationOutcome",
+            "issue": [
+                {
+                    "severity": "warning",
+                    "code": "incomplete",
+                    "diagnostics": f"Server {name} is unavailable; results may be incomplete"
+                }
+                for name in unavailable
+            ]
+        },
+        "search": {"mode": "outcome"}
+    }
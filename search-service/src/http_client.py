@@ -0,0 +1,91 @@
+import asyncio
+import time
+import httpx
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from config import (
+    POOL_MAX_CONNECTIONS, POOL_MAX_KEEPALIVE, KEEPALIVE_EXPIRY,
+    MAX_RETRIES, BACKOFF_FACTOR, MAX_RETRY_DELAY, RETRY_STATUSES, UPSTREAM_TIMEOUT
+)
+from registry import registry
+
+def pool_size(url: httpx.URL) -> int:
+    """The pool_size of the registry server with a replica at the URL's host, or UPSTREAM_POOL_SIZE"""
+    for server in registry.servers():
+        for replica in server['replicas']:
+            replica_url = httpx.URL(replica['url'])
+            if (replica_url.scheme, replica_url.host, replica_url.port) == (url.scheme, url.host, url.port):
+                return server.get('pool_size', POOL_MAX_CONNECTIONS)
+    return POOL_MAX_CONNECTIONS
+
+class HostPoolTransport(httpx.AsyncBaseTransport):
+    """
+    Transport giving every upstream host a connection pool of its own, sized
+    by its server's pool_size. httpx.Limits on a single transport caps
+    connections across all hosts together, so one hung server could hold
+    every connection and stall requests to the healthy ones.
+
+    Pools are keyed by host and size, so a server resized in the registry
+    gets a new pool while requests on the old one finish.
+    """
+
+    def __init__(self):
+        self.pools: Dict[Tuple[str, str, Optional[int], int], httpx.AsyncHTTPTransport] = {}
+
+    def pool(self, url: httpx.URL) -> httpx.AsyncHTTPTransport:
+        size = pool_size(url)
+        key = (url.scheme, url.host, url.port, size)
+        if key not in self.pools:
+            self.pools[key] = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+                max_connections=size,
+                max_keepalive_connections=min(POOL_MAX_KEEPALIVE, size),
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ))
+        return self.pools[key]
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.pool(request.url).handle_async_request(request)
+
+    async def aclose(self) -> None:
+        for pool in self.pools.values():
+            await pool.aclose()
+
+def create_client() -> httpx.AsyncClient:
+    """
+    Create the keep-alive client used for all upstream FHIR requests, with a
+    separate connection pool per upstream host (see HostPoolTransport)
+    """
+    return httpx.AsyncClient(
+        headers={"Accept": "application/fhir+json"},
+        timeout=UPSTREAM_TIMEOUT,
+        transport=HostPoolTransport()
+    )
+
+def retry_delay(response: httpx.Response, attempt: int) -> float:
+    """
+    Seconds to wait before the next attempt, honouring Retry-After when
+    present, at most UPSTREAM_MAX_RETRY_DELAY
+    """
+    retry_after = response.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), MAX_RETRY_DELAY)
+    return min(BACKOFF_FACTOR * (2 ** attempt), MAX_RETRY_DELAY)
+
+async def send_with_retry(send: Callable[[], Awaitable[httpx.Response]], timeout: float) -> httpx.Response:
+    """
+    Send a request, retrying with exponential backoff while the server
+    answers 429/503, unless the wait would run past the request's timeout.
+    Each refused response is closed before waiting, so a streamed one gives
+    its connection back.
+    """
+    deadline = time.monotonic() + timeout
+    response: Optional[httpx.Response] = None
+    for attempt in range(MAX_RETRIES + 1):
+        response = await send()
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            break
+        delay = retry_delay(response, attempt)
+        if time.monotonic() + delay > deadline:
+            break
+        await response.aclose()
+        await asyncio.sleep(delay)
+    return response
@@ -0,0 +1,227 @@
+import asyncio
+import httpx
+import orjson
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from capabilities import routing_table
+from config import INCLUDE_BATCH_SIZE, INCLUDE_MAX_ENTRIES
+from federation import build_search_url, next_link, tag_source
+from health import server_health, get_from
+from registry import registry
+from tracing import upstream_span, record_entries
+
+# A resource as (server name, resource type, id)
+Target = Tuple[str, str, str]
+
+# Search parameters not named after the element they search
+PARAMETER_ELEMENTS = {'patient': 'subject'}
+
+def parse_include(value: str) -> Optional[Tuple[str, str, Optional[str]]]:
+    """
+    Split 'Observation:subject' or 'Observation:subject:Patient' into source
+    type, parameter and target type. Wildcards are not resolved (None).
+    """
+    parts = value.split(':')
+    if len(parts) not in (2, 3) or '*' in parts:
+        return None
+    return parts[0], parts[1], parts[2] if len(parts) == 3 else None
+
+def element_references(value: Any) -> Iterator[str]:
+    """Every reference string in an element, however deeply nested (e.g. Patient.link.other)"""
+    if isinstance(value, list):
+        for item in value:
+            yield from element_references(item)
+    elif isinstance(value, dict):
+        if isinstance(value.get('reference'), str):
+            yield value['reference']
+        for item in value.values():
+            if isinstance(item, (dict, list)):
+                yield from element_references(item)
+
+def entry_target(entry: Dict[str, Any]) -> Target:
+    """Where a tagged entry's resource lives"""
+    resource = entry['resource']
+    return resource['meta']['source'], resource['resourceType'], resource['id']
+
+def resolve(reference: str, source: str) -> Optional[Target]:
+    """
+    The resource a reference found on the source server points at. Absolute
+    references name their server by base URL; relative ones stay on the
+    source server. Contained, urn: and unknown-server references are None.
+    """
+    owner, path = source, reference
+    if '://' in reference:
+        base = next((
+            (server['name'], replica['url']) for server in registry.servers()
+            for replica in server['replicas']
+            if reference.startswith(replica['url'] + '/')
+        ), None)
+        if base is None:
+            return None
+        owner, path = base[0], reference[len(base[1]) + 1:]
+    elif reference.startswith(('#', 'urn:')):
+        return None
+    parts = path.split('/')
+    if len(parts) < 2 or not parts[0] or not parts[1]:
+        return None
+    return owner, parts[0], parts[1]
+
+def absolute_reference(target: Target) -> Optional[str]:
+    """Reference to a resource by the base URL of the server holding it, as the cohort generator writes them"""
+    owner, resource_type, id = target
+    server = registry.get(owner)
+    if server is None:
+        return None
+    return f"{server['url']}/{resource_type}/{id}"
+
+def references_on(server: Dict[str, Any], targets: List[Target]) -> str:
+    """
+    The references under which a server may refer to the given resources,
+    comma-joined for a search. A relative reference only ever means a
+    resource on the same server, so other servers' resources are searched
+    for by absolute reference alone.
+    """
+    references = []
+    for target in targets:
+        owner, resource_type, id = target
+        if owner == server['name']:
+            references.append(f"{resource_type}/{id}")
+        reference = absolute_reference(target)
+        if reference:
+            references.append(reference)
+    return ",".join(references)
+
+def batches(values: List[Any]) -> Iterator[List[Any]]:
+    for start in range(0, len(values), INCLUDE_BATCH_SIZE):
+        yield values[start:start + INCLUDE_BATCH_SIZE]
+
+def truncation_entry() -> Dict[str, Any]:
+    """An OperationOutcome entry telling the client that included resources were left out"""
+    return {
+        "resource": {
+            "resourceType": "OperationOutcome",
+            "issue": [{
+                "severity": "warning",
+                "code": "too-costly",
+                "diagnostics": f"Only the first {INCLUDE_MAX_ENTRIES} included resources are returned"
+            }]
+        },
+        "search": {"mode": "outcome"}
+    }
+
+async def fetch_included(client: httpx.AsyncClient, server: Dict[str, Any], resource_type: str,
+                         search_params: Dict[str, str]) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    The pages of one search, tagged and marked as include entries, up to
+    INCLUDE_MAX_ENTRIES of them; a failed search gives no entries. Also
+    returns whether the limit left any out.
+    """
+    included: List[Dict[str, Any]] = []
+    url = build_search_url(server, resource_type, search_params)
+    try:
+        while url:
+            with upstream_span(server, url):
+                response = await get_from(client, server, url)
+                if response.status_code != 200:
+                    break
+                bundle = orjson.loads(response.content)
+                entries = [
+                    entry for entry in bundle.get('entry', [])
+                    if 'resource' in entry and entry.get('search', {}).get('mode') != 'outcome'
+                ]
+                record_entries(entries)
+            tag_source(entries, server['name'])
+            for entry in entries:
+                entry['search'] = {'mode': 'include'}
+            included.extend(entries)
+            url = next_link(bundle)
+            if len(included) >= INCLUDE_MAX_ENTRIES:
+                return included[:INCLUDE_MAX_ENTRIES], len(included) > INCLUDE_MAX_ENTRIES or url is not None
+    except httpx.HTTPError as e:
+        print(f"Error resolving includes on {server['name']}: {str(e)}")
+    return included, False
+
+async def federated_includes(client: httpx.AsyncClient, bundle: Dict[str, Any],
+                             includes: Sequence[str], revincludes: Sequence[str]) -> List[Dict[str, Any]]:
+    """
+    Resolve _include and _revinclude across servers for a page of results.
+
+    _include targets are collected from the matches, grouped by owning server
+    and type, and fetched with batched _id=a,b,c searches. _revinclude
+    searches every server that may hold the source type for references to
+    the matches, in the form each server would store them. All searches run
+    in parallel, and resources already in the Bundle (such as those the
+    answering server included itself) are not returned again. At most
+    INCLUDE_MAX_ENTRIES resources are returned, followed by an
+    OperationOutcome entry if that left any out.
+    """
+    # Only resources from a server count: OperationOutcome entries (ours or upstream) have no location
+    entries = [
+        entry for entry in bundle.get('entry', [])
+        if entry.get('search', {}).get('mode', 'match') in ('match', 'include')
+        and entry.get('resource', {}).get('id') and entry['resource'].get('meta', {}).get('source')
+    ]
+    matches = [entry for entry in entries if entry.get('search', {}).get('mode', 'match') == 'match']
+    present = {entry_target(entry) for entry in entries}
+
+    requested = set(present)
+    wanted: Dict[Tuple[str, str], List[str]] = {}
+    for value in includes:
+        spec = parse_include(value)
+        if spec is None:
+            continue
+        source_type, parameter, target_type = spec
+        element = PARAMETER_ELEMENTS.get(parameter, parameter)
+        for entry in matches:
+            resource = entry['resource']
+            if resource['resourceType'] != source_type:
+                continue
+            for reference in element_references(resource.get(element)):
+                target = resolve(reference, resource['meta']['source'])
+                if target is None or target in requested or (target_type and target[1] != target_type):
+                    continue
+                requested.add(target)
+                wanted.setdefault(target[:2], []).append(target[2])
+
+    searches = []
+    for (owner, resource_type), ids in wanted.items():
+        server = registry.get(owner)
+        if server is None or not server_health.available(owner):
+            continue
+        for batch in batches(ids):
+            searches.append((server, resource_type, {'_id': ",".join(batch), '_count': str(len(batch))}))
+
+    for value in revincludes:
+        spec = parse_include(value)
+        if spec is None:
+            continue
+        source_type, parameter, target_type = spec
+        targets = [
+            entry_target(entry) for entry in matches
+            if not target_type or entry['resource']['resourceType'] == target_type
+        ]
+        if not targets:
+            continue
+        for server in server_health.route(routing_table.servers(source_type)):
+            for batch in batches(targets):
+                searches.append((server, source_type, {parameter: references_on(server, batch)}))
+
+    results = await asyncio.gather(*(
+        fetch_included(client, server, resource_type, search_params)
+        for server, resource_type, search_params in searches
+    ))
+    included = []
+    truncated = False
+    for entries, cut in results:
+        truncated = truncated or cut
+        for entry in entries:
+            target = entry_target(entry)
+            if target in present:
+                continue
+            if len(included) == INCLUDE_MAX_ENTRIES:
+                truncated = True
+                break
+            present.add(target)
+            included.append(entry)
+    if truncated:
+        included.append(truncation_entry())
+    return included
@@ -0,0 +1,150 @@
+import asyncio
+import httpx
+import orjson
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Any, List, Optional
+from config import LOCATION_INDEX_MAX_ENTRIES, HISTORY_PAGE_SIZE
+from health import server_health, get_from
+from registry import registry, server_url
+from tracing import upstream_span, record_entries
+
+def rank(server_name: str) -> int:
+    """Position of a server in priority order; servers no longer registered come last"""
+    names = [server['name'] for server in registry.servers()]
+    return names.index(server_name) if server_name in names else len(names)
+
+class LocationIndex:
+    """
+    Bounded map of 'ResourceType/id' to the name of the server that holds it.
+
+    HAPI assigns ids sequentially, so the same id (Patient/1, say) usually
+    exists on several servers. The index keeps the highest-priority one,
+    the server a priority search would answer from, whatever order they are
+    seen in.
+
+    Entries are learnt from search results and history scans. A lookup that
+    turns out to be wrong is removed with forget(), so the next search
+    re-learns the right location.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.locations: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.corrections = 0
+
+    def lookup(self, resource_type: str, id: str) -> Optional[str]:
+        key = f"{resource_type}/{id}"
+        server_name = self.locations.get(key)
+        if server_name is None:
+            self.misses += 1
+            return None
+        self.locations.move_to_end(key)
+        self.hits += 1
+        return server_name
+
+    def record(self, resource_type: str, id: str, server_name: str) -> None:
+        if self.max_entries <= 0:
+            return
+        key = f"{resource_type}/{id}"
+        owner = self.locations.get(key)
+        if owner is None or rank(server_name) < rank(owner):
+            self.locations[key] = server_name
+        self.locations.move_to_end(key)
+        while len(self.locations) > self.max_entries:
+            self.locations.popitem(last=False)
+
+    def record_entries(self, entries: List[Dict[str, Any]], server_name: str) -> None:
+        """Remember the location of every resource in a list of Bundle entries"""
+        for entry in entries:
+            resource = entry.get('resource')
+            if resource and resource.get('id'):
+                self.record(resource['resourceType'], resource['id'], server_name)
+
+    def forget(self, resource_type: str, id: str) -> None:
+        if self.locations.pop(f"{resource_type}/{id}", None) is not None:
+            self.corrections += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self.locations),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "corrections": self.corrections
+        }
+
+location_index = LocationIndex(LOCATION_INDEX_MAX_ENTRIES)
+
+# Server time at the start of the last completed history scan per server, used as _since next time
+last_scanned: Dict[str, str] = {}
+
+def server_time(response: httpx.Response, bundle: Dict[str, Any]) -> Optional[str]:
+    """
+    When the server answered by its own clock, as a _since value: the
+    Bundle's meta.lastUpdated, or else the response's Date header. Our clock
+    may be skewed from the server's, which would make _since skip changes.
+    """
+    moment = None
+    try:
+        moment = datetime.fromisoformat(bundle['meta']['lastUpdated'].replace('Z', '+00:00'))
+    except (KeyError, AttributeError, ValueError):
+        try:
+            moment = parsedate_to_datetime(response.headers['Date'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+async def scan_history(client: httpx.AsyncClient, server: Dict[str, Any]) -> int:
+    """
+    Walk a server's system-level _history and record the location of every
+    resource in it. After the first full scan only changes since the previous
+    scan are read, as of the server's time when the previous one started.
+    Returns the number of entries seen.
+    """
+    started: Optional[str] = None
+    params = {'_count': str(HISTORY_PAGE_SIZE)}
+    if server['name'] in last_scanned:
+        params['_since'] = last_scanned[server['name']]
+    url = str(httpx.URL(f"{server_url(server)}/_history", params=params))
+
+    seen = 0
+    while url and seen < location_index.max_entries:
+        with upstream_span(server, url):
+            response = await get_from(client, server, url)
+            if response.status_code != 200:
+                return seen
+            bundle = orjson.loads(response.content)
+            entries = bundle.get('entry', [])
+            record_entries(entries)
+        started = started or server_time(response, bundle)
+        location_index.record_entries(entries, server['name'])
+        seen += len(entries)
+        url = next((link['url'] for link in bundle.get('link', []) if link.get('relation') == 'next'), None)
+
+    if started:
+        last_scanned[server['name']] = started
+    return seen
+
+async def scan_periodically(client: httpx.AsyncClient, servers: Callable[[], List[Dict[str, Any]]], interval: float) -> None:
+    """
+    Background task: rescan the history of every server returned by servers()
+    each interval seconds, skipping servers that are down
+    """
+    while True:
+        for server in servers():
+            if server_health.down(server['name']):
+                continue
+            try:
+                seen = await scan_history(client, server)
+                print(f"Indexed {seen} {server['name']} history entries")
+            except httpx.HTTPError as e:
+                print(f"Error scanning history of {server['name']}: {str(e)}")
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
@@ -0,0 +1,305 @@
+import asyncio
+import functools
+import sqlite3
+import time
+import httpx
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+from config import HISTORY_PAGE_SIZE, VIEW_DB
+from federation import next_link
+from health import server_health, get_from
+from includes import resolve
+from location_index import server_time
+from registry import server_url
+
+GESTATIONAL_AGE_CODE = "49052-4"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cursors (
+    server TEXT PRIMARY KEY,
+    since TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS facts (
+    server TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    patient_server TEXT NOT NULL,
+    patient_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    code TEXT NOT NULL,
+    display TEXT,
+    value REAL,
+    unit TEXT,
+    effective TEXT
+);
+CREATE INDEX IF NOT EXISTS facts_by_resource ON facts (server, resource_type, id);
+CREATE INDEX IF NOT EXISTS facts_by_patient ON facts (patient_id, kind, effective);
+CREATE TEMP TABLE IF NOT EXISTS applied (
+    server TEXT NOT NULL,
+    resource_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (server, resource_type, id)
+);
+"""
+
+T = TypeVar('T')
+
+# One row of the facts table, after the resource's server, type and id
+Fact = Tuple[str, str, str, str, Optional[str], Optional[float], Optional[str], Optional[str]]
+
+def instant(value: Optional[str]) -> Optional[str]:
+    """A FHIR date or dateTime as a UTC timestamp string that sorts correctly; None if unparseable"""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def coding(concept: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+    """Code and display of a CodeableConcept's first coding"""
+    codings = (concept or {}).get('coding') or [{}]
+    return codings[0].get('code'), codings[0].get('display', (concept or {}).get('text'))
+
+def is_vital(resource: Dict[str, Any]) -> bool:
+    return any(
+        code == 'vital-signs'
+        for category in resource.get('category', [])
+        for code, _ in [coding(category)]
+    )
+
+def resource_facts(resource: Dict[str, Any]) -> Iterator[Fact]:
+    """
+    The key prenatal facts a resource records, each as (patient server,
+    patient id, kind, code, display, value, unit, effective):
+
+    - 'vital': each quantity of a vital-signs Observation, components included
+    - 'gestational_age': weeks, from any Observation or component coded 49052-4
+    - 'delivery_plan': each activity of a CarePlan
+    - 'risk_factor': each prediction of a RiskAssessment, valued by probability
+    """
+    subject = resource.get('subject', {}).get('reference')
+    patient = resolve(subject, resource['meta']['source']) if subject else None
+    if patient is None or patient[1] != 'Patient':
+        return
+    effective = instant(
+        resource.get('effectiveDateTime') or resource.get('effectivePeriod', {}).get('start')
+        or resource.get('occurrenceDateTime') or resource.get('created')
+        or resource.get('meta', {}).get('lastUpdated')
+    )
+    patient_server, patient_id = patient[0], patient[2]
+    resource_type = resource['resourceType']
+
+    if resource_type == 'Observation':
+        vital = is_vital(resource)
+        for part in [resource, *resource.get('component', [])]:
+            code, display = coding(part.get('code'))
+            quantity = part.get('valueQuantity')
+            if code is None or quantity is None or 'value' not in quantity:
+                continue
+            if code == GESTATIONAL_AGE_CODE:
+                kind = 'gestational_age'
+            elif vital:
+                kind = 'vital'
+            else:
+                continue
+            yield (patient_server, patient_id, kind, code, display,
+                   float(quantity['value']), quantity.get('unit', quantity.get('code')), effective)
+    elif resource_type == 'CarePlan':
+        for activity in resource.get('activity', []):
+            code, display = coding(activity.get('detail', {}).get('code'))
+            if code is not None:
+                yield patient_server, patient_id, 'delivery_plan', code, display, None, None, effective
+    elif resource_type == 'RiskAssessment':
+        for prediction in resource.get('prediction', []):
+            code, display = coding(prediction.get('outcome'))
+            if code is not None:
+                yield (patient_server, patient_id, 'risk_factor', code, display,
+                       prediction.get('probabilityDecimal'), None, effective)
+
+class MaterializedView:
+    """
+    A local, read-optimized copy of the key prenatal facts on every server
+    (see resource_facts), in SQLite. sync_server() applies a server's changes
+    since its cursor, which is stored with the facts so a restart carries
+    on where it left off instead of rescanning everything.
+
+    Facts are keyed by the resource they came from: a new version replaces
+    them and a deletion removes them. Patients are identified by the server
+    holding them and their id, following absolute references, so obstetric
+    records written against a maternal Patient land on that Patient.
+
+    The methods block on SQLite, so the service calls them through run(),
+    which queues them on the view's own thread, one at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # Created at import, then only used from the executor's single thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="view")
+        self.applied = 0
+        self.queries = 0
+
+    async def run(self, method: Callable[..., T], *args: Any) -> T:
+        """Call one of the view's methods on its thread, off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(method, *args))
+
+    def cursor(self, server_name: str) -> Optional[str]:
+        row = self.db.execute("SELECT since FROM cursors WHERE server = ?", (server_name,)).fetchone()
+        return row[0] if row else None
+
+    def begin(self, server_name: str) -> None:
+        """Start a scan of a server's history, forgetting which resources the last one applied"""
+        with self.db:
+            self.db.execute("DELETE FROM applied WHERE server = ?", (server_name,))
+
+    def apply(self, entries: List[Dict[str, Any]], server_name: str) -> None:
+        """
+        Apply one page of _history entries, newest first. Only the newest
+        version of each resource counts; the applied temp table holds those
+        already seen in this scan, so a full scan of a large server does not
+        build up in memory.
+        """
+        with self.db:
+            for entry in entries:
+                resource = entry.get('resource')
+                if resource is not None:
+                    key = (resource.get('resourceType'), resource.get('id'))
+                else:
+                    # Deletions carry no resource, only the request that deleted it
+                    parts = entry.get('request', {}).get('url', '').split('/')
+                    key = (parts[0], parts[1]) if len(parts) >= 2 else (None, None)
+                if None in key:
+                    continue
+                seen = self.db.execute("INSERT OR IGNORE INTO applied VALUES (?, ?, ?)", (server_name, *key))
+                if seen.rowcount == 0:
+                    continue
+                self.db.execute(
+                    "DELETE FROM facts WHERE server = ? AND resource_type = ? AND id = ?",
+                    (server_name, *key)
+                )
+                if resource is None or entry.get('request', {}).get('method') == 'DELETE':
+                    continue
+                resource['meta'] = {**resource.get('meta', {}), 'source': server_name}
+                self.db.executemany(
+                    "INSERT INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(server_name, *key, *fact) for fact in resource_facts(resource)]
+                )
+                self.applied += 1
+
+    def advance(self, server_name: str, since: Optional[str]) -> None:
+        """Finish a scan, moving the server's cursor to since if known"""
+        with self.db:
+            if since:
+                self.db.execute(
+                    "INSERT INTO cursors VALUES (?, ?) ON CONFLICT(server) DO UPDATE SET since = excluded.since",
+                    (server_name, since)
+                )
+            self.db.execute("DELETE FROM applied WHERE server = ?", (server_name,))
+
+    def summary(self, patient_id: str, patient_server: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Latest vitals and gestational age, current delivery plan and risk
+        factors of a patient; None if the view holds nothing about them
+        """
+        self.queries += 1
+        query = "SELECT kind, code, display, value, unit, effective, server FROM facts WHERE patient_id = ?"
+        params: Tuple[str, ...] = (patient_id,)
+        if patient_server:
+            query += " AND patient_server = ?"
+            params += (patient_server,)
+        rows = self.db.execute(query + " ORDER BY effective DESC", params).fetchall()
+        if not rows:
+            return None
+
+        latest: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        latest_effective: Dict[str, Optional[str]] = {}
+        for kind, code, display, value, unit, effective, server in rows:
+            latest_effective.setdefault(kind, effective)
+            if (kind, code) not in latest:
+                latest[(kind, code)] = {
+                    "code": code, "display": display, "value": value,
+                    "unit": unit, "effective": effective, "source": server
+                }
+
+        def facts(kind: str, current_only: bool = False) -> List[Dict[str, Any]]:
+            # Delivery plans and risk factors come as a set, so only the newest set counts
+            return [
+                fact for (fact_kind, _), fact in latest.items()
+                if fact_kind == kind and (not current_only or fact['effective'] == latest_effective[kind])
+            ]
+
+        gestational_age = facts('gestational_age')
+        return {
+            "patient": patient_id,
+            "vitals": facts('vital'),
+            "gestational_age": gestational_age[0] if gestational_age else None,
+            "delivery_plan": facts('delivery_plan', current_only=True),
+            "risk_factors": facts('risk_factor', current_only=True)
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "facts": self.db.execute("SELECT COUNT(*) FROM facts").fetchone()[0],
+            "cursors": dict(self.db.execute("SELECT server, since FROM cursors").fetchall()),
+            "applied": self.applied,
+            "queries": self.queries
+        }
+
+materialized_view = MaterializedView(VIEW_DB)
+
+async def sync_server(client: httpx.AsyncClient, server: Dict[str, Any]) -> int:
+    """
+    Apply a server's _history since its cursor to the view, and move the
+    cursor to when this scan started, by the server's clock, once every page
+    has been applied. Returns the number of history entries read.
+    """
+    view = materialized_view
+    started: Optional[str] = None
+    params = {'_count': str(HISTORY_PAGE_SIZE)}
+    since = await view.run(view.cursor, server['name'])
+    if since:
+        params['_since'] = since
+    url: Optional[str] = str(httpx.URL(f"{server_url(server)}/_history", params=params))
+
+    seen = 0
+    await view.run(view.begin, server['name'])
+    while url:
+        response = await get_from(client, server, url)
+        if response.status_code != 200:
+            return seen
+        bundle = orjson.loads(response.content)
+        started = started or server_time(response, bundle)
+        entries = bundle.get('entry', [])
+        await view.run(view.apply, entries, server['name'])
+        seen += len(entries)
+        url = next_link(bundle)
+
+    await view.run(view.advance, server['name'], started)
+    return seen
+
+async def sync_periodically(client: httpx.AsyncClient, servers: Callable[[], List[Dict[str, Any]]], interval: float) -> None:
+    """
+    Background task: bring the view up to date with every server returned
+    by servers() each interval seconds, skipping servers that are down
+    """
+    while True:
+        for server in servers():
+            if server_health.down(server['name']):
+                continue
+            try:
+                started = time.perf_counter()
+                seen = await sync_server(client, server)
+                print(f"Applied {seen} {server['name']} history entries to the view in {time.perf_counter() - started:.2f}s")
+            except httpx.HTTPError as e:
+                print(f"Error syncing the view from {server['name']}: {str(e)}")
+        if interval <= 0:
+            return
+        await asyncio.sleep(interval)
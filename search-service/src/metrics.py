@@ -0,0 +1,78 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram
+
+# Requests served by the search service, labelled by route template (e.g. /fhir/{resource_type})
+REQUESTS = Counter(
+    "search_requests_total", "Requests served by the search service", ["route", "method", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "search_request_duration_seconds", "Time to serve a request, including streaming the body", ["route"]
+)
+REQUESTS_IN_FLIGHT = Gauge("search_requests_in_flight", "Requests currently being served")
+RESPONSE_BYTES = Counter("search_response_bytes_total", "Response body bytes sent to clients", ["route"])
+
+# Calls to the upstream FHIR servers
+UPSTREAM_REQUESTS = Counter(
+    "search_upstream_requests_total", "Requests sent to upstream FHIR servers", ["server", "status"]
+)
+UPSTREAM_LATENCY = Histogram(
+    "search_upstream_request_duration_seconds",
+    "Time until an upstream server answered (headers only for streamed responses)",
+    ["server"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+UPSTREAM_IN_FLIGHT = Gauge("search_upstream_requests_in_flight", "Upstream requests awaiting an answer", ["server"])
+UPSTREAM_BYTES = Counter("search_upstream_bytes_total", "Response body bytes received from upstream servers", ["server"])
+UPSTREAM_ERRORS = Counter(
+    "search_upstream_errors_total", "Failed upstream requests: timeouts, connection errors and 5xx answers",
+    ["server", "reason"]
+)
+
+# Sampled from the cache and circuit breakers at scrape time
+CACHE_HIT_RATIO = Gauge("search_cache_hit_ratio", "Response cache hits / lookups since startup")
+CACHE_ENTRIES = Gauge("search_cache_entries", "Entries in the response cache")
+UPSTREAM_UP = Gauge("search_upstream_up", "1 while a server is being routed to, 0 while it is skipped", ["server"])
+
+# Requests that joined an identical in-flight upstream fan-out instead of starting their own
+COALESCED_REQUESTS = Counter(
+    "search_coalesced_requests_total", "Requests answered by sharing an in-flight fan-out", ["kind"]
+)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording count, latency and body size of every HTTP
+    request. Bytes are counted as they are sent, so streamed Bundles are
+    measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        sent = 0
+
+        async def send_and_count(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_count)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUESTS.labels(path, scope["method"], str(status)).inc()
+            REQUEST_LATENCY.labels(path).observe(time.perf_counter() - started)
+            RESPONSE_BYTES.labels(path).inc(sent)
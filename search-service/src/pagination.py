@@ -0,0 +1,115 @@
+import asyncio
+import base64
+import json
+import httpx
+import orjson
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+from health import server_health, get_from, outcome_entry
+from registry import server_url
+from tracing import upstream_span, record_entries
+from federation import tag_source, next_link
+
+def encode_cursor(pages: Dict[str, Any], total: Optional[int], order: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Encode each server's upstream paging state into an opaque cursor token.
+    Only the query string of an upstream next link is kept, so the token never
+    exposes backend host names. Sorted searches also carry their order
+    (_sort and _count).
+    """
+    state = {"p": pages, "t": total}
+    if order:
+        state["o"] = order
+    raw = json.dumps(state, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token: str) -> Tuple[Dict[str, Any], Optional[int], Optional[Dict[str, Any]]]:
+    """Decode a cursor token, raising ValueError if it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        state = json.loads(raw)
+        pages = state["p"]
+        if not isinstance(pages, dict):
+            raise ValueError("cursor pages must be an object")
+        order = state.get("o")
+        if order is not None and not isinstance(order, dict):
+            raise ValueError("cursor order must be an object")
+        return pages, state.get("t"), order
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+def page_query(url: str) -> str:
+    """Strip the host from an upstream next link, keeping only its paging query"""
+    return urlsplit(url).query
+
+async def fetch_page(client: httpx.AsyncClient, server: Dict[str, Any], url: str) -> Optional[Dict[Any, Any]]:
+    """Fetch one page of results from a server, or None if the request failed"""
+    try:
+        with upstream_span(server, url):
+            response = await get_from(client, server, url)
+            if response.status_code == 200:
+                bundle = orjson.loads(response.content)
+                record_entries(bundle.get('entry', []))
+                return bundle
+    except httpx.HTTPError as e:
+        print(f"Error querying {server['name']}: {str(e)}")
+    return None
+
+async def federated_page(client: httpx.AsyncClient, requests: List[Tuple[Dict[str, Any], str]]) -> Tuple[List[Dict[str, Any]], Dict[str, str], int]:
+    """
+    Fetch one page from each (server, url) pair concurrently.
+
+    Returns the combined, source-tagged entries (de-duplicated by fullUrl), the
+    next-page state for every server that has more results, and the sum of the
+    upstream totals. Servers that are down are skipped; skipped and failed
+    servers are listed in an OperationOutcome entry after the results.
+    """
+    available, failed = [], []
+    for server, url in requests:
+        if server_health.available(server['name']):
+            available.append((server, url))
+        else:
+            failed.append(server['name'])
+    bundles = await asyncio.gather(*(fetch_page(client, server, url) for server, url in available))
+
+    entries = []
+    seen = set()
+    pages = {}
+    total = 0
+    for (server, _), bundle in zip(available, bundles):
+        if not bundle:
+            failed.append(server['name'])
+            continue
+        total += bundle.get('total', 0)
+        server_entries = bundle.get('entry', [])
+        tag_source(server_entries, server['name'])
+        for entry in server_entries:
+            full_url = entry.get('fullUrl')
+            if full_url:
+                if full_url in seen:
+                    continue
+                seen.add(full_url)
+            entries.append(entry)
+        upstream_next = next_link(bundle)
+        if upstream_next:
+            pages[server['name']] = page_query(upstream_next)
+    outcome = outcome_entry(failed)
+    if outcome:
+        entries.append(outcome)
+    return entries, pages, total
+
+def cursor_requests(servers: List[Dict[str, Any]], pages: Dict[str, str]) -> List[Tuple[Dict[str, Any], str]]:
+    """Resolve the per-server paging state of a cursor back into upstream URLs"""
+    by_name = {server['name']: server for server in servers}
+    return [
+        (by_name[name], f"{server_url(by_name[name])}?{query}")
+        for name, query in pages.items()
+        if name in by_name
+    ]
+
+def paged_links(self_url: str, next_url: Optional[str]) -> List[Dict[str, str]]:
+    """Build the link list for a federated page"""
+    links = [{"relation": "self", "url": self_url}]
+    if next_url:
+        links.append({"relation": "next", "url": next_url})
+    return links
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import random
+import yaml
+from typing import Any, Dict, List, Optional
+from config import FHIR_SERVERS, SERVERS_FILE
+
+def normalize(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Validate one logical server from the registry and fill in defaults. A
+    server has either a single url or a list of weighted replicas; 'url' is
+    always set to the first replica.
+    """
+    replicas = entry.get('replicas') or [{'url': entry['url']}]
+    replicas = [
+        {'url': replica['url'].rstrip('/'), 'weight': float(replica.get('weight', 1))}
+        for replica in replicas
+    ]
+    if any(replica['weight'] <= 0 for replica in replicas):
+        raise ValueError(f"Replica weights of {entry['name']} must be positive")
+
+    server = {
+        'name': str(entry['name']),
+        'url': replicas[0]['url'],
+        'priority': int(entry.get('priority', 100)),
+        'replicas': replicas
+    }
+    if 'timeout' in entry:
+        server['timeout'] = float(entry['timeout'])
+    if 'pool_size' in entry:
+        server['pool_size'] = int(entry['pool_size'])
+    if 'resource_types' in entry:
+        server['resource_types'] = [str(resource_type) for resource_type in entry['resource_types']]
+    return server
+
+def load_servers(path: str) -> List[Dict[str, Any]]:
+    """Read the registry file, returning its servers in priority order"""
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    servers = [normalize(entry) for entry in data.get('servers') or []]
+    if not servers:
+        raise ValueError("No servers defined")
+    names = [server['name'] for server in servers]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate server names in {names}")
+    return sorted(servers, key=lambda x: x['priority'])
+
+class ServerRegistry:
+    """
+    The upstream FHIR servers, loaded from a YAML file (FHIR_SERVERS_FILE) and
+    reloaded whenever it changes. Without the file, the built-in FHIR_SERVERS
+    are used.
+
+    A reload swaps in a new list rather than changing the old one, so requests
+    already in flight finish against the servers they started with. A file
+    that fails to load is reported and the current servers stay in place.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime: Optional[float] = None
+        self.current = sorted((normalize(server) for server in FHIR_SERVERS), key=lambda x: x['priority'])
+        self.reload()
+
+    def reload(self) -> bool:
+        """Load the file if it changed since the last load; returns whether the servers changed"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        try:
+            servers = load_servers(self.path)
+        except (OSError, KeyError, TypeError, ValueError, yaml.YAMLError) as e:
+            print(f"Error loading server registry {self.path}: {str(e)}")
+            return False
+        self.current = servers
+        print(f"Loaded {len(servers)} servers from {self.path}")
+        return True
+
+    def servers(self, resource_type: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Servers in priority order. Given a resource type, servers whose
+        resource_types affinity list does not include it are left out.
+        """
+        servers = self.current
+        if resource_type is None:
+            return servers
+        return [
+            server for server in servers
+            if 'resource_types' not in server or resource_type in server['resource_types']
+        ]
+
+    def get(self, name: Optional[str]) -> Optional[Dict[str, Any]]:
+        return next((server for server in self.current if server['name'] == name), None)
+
+    async def watch(self, interval: float) -> None:
+        """Background task: check the file for changes every interval seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            self.reload()
+
+registry = ServerRegistry(SERVERS_FILE)
+
+def server_url(server: Dict[str, Any]) -> str:
+    """Base URL of one of the server's replicas, picked at random by weight"""
+    replicas = server.get('replicas')
+    if not replicas or len(replicas) == 1:
+        return server['url']
+    return random.choices(replicas, weights=[replica['weight'] for replica in replicas])[0]['url']
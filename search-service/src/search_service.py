@@ -1,81 +1,745 @@
-from fastapi import FastAPI, HTTPException, Request
-from typing import Optional, Dict, Any
-import requests
-from config import FHIR_SERVERS
-from urllib.parse import urlencode
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from typing import Optional, Dict, Any, List, Sequence, Tuple
+import asyncio
+import httpx
+import ijson
+import math
+import orjson
+import time
+from config import (
+    CACHE_MAX_ENTRIES, CACHE_DEFAULT_TTL, CACHE_TTLS, LOCATION_SCAN_INTERVAL,
+    STREAM_MIN_COUNT, HEALTH_PROBE_INTERVAL, REGISTRY_RELOAD_INTERVAL,
+    CAPABILITY_REFRESH_INTERVAL, BATCH_MAX_ENTRIES, BATCH_CONCURRENCY, SORT_DEFAULT_COUNT,
+    AGGREGATE_CACHE_TTL, AGGREGATE_CACHE_MAX_ENTRIES, VIEW_SYNC_INTERVAL
+)
+from http_client import create_client
+from federation import build_search_url, tag_source, merged_bundle, next_link
+from everything import everything_bundle
+from includes import federated_includes
+from aggregate import aggregate
+from materialized_view import materialized_view, sync_periodically
+from sorting import parse_sort, search_sources, cursor_sources, sorted_page, SortedSource
+from pagination import (
+    encode_cursor, decode_cursor, page_query, federated_page,
+    cursor_requests, paged_links
+)
+from cache import ResponseCache, cache_key, parse_ttls
+from location_index import location_index, scan_periodically
+from streaming import StreamedBundle, passthrough
+from health import (
+    server_health, get_from, stream_from, probe, probe_periodically, outcome_entry, is_partial
+)
+from tracing import tracer, traced, upstream_span, record_entries
+from singleflight import SingleFlight
+from registry import registry, server_url
+from capabilities import routing_table, refresh_periodically
+from metrics import MetricsMiddleware, CACHE_HIT_RATIO, CACHE_ENTRIES, UPSTREAM_UP
+from http import HTTPStatus
+from urllib.parse import urlencode, urlsplit, parse_qsl
 
-app = FastAPI()
+# Responses that do need a full parse are serialized with orjson
+app = FastAPI(default_response_class=ORJSONResponse)
+app.add_middleware(MetricsMiddleware)
 
+# Shared async HTTP client, created on startup so every request reuses its connections
+http_client: Optional[httpx.AsyncClient] = None
+
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_DEFAULT_TTL, parse_ttls(CACHE_TTLS))
+aggregate_cache = ResponseCache(AGGREGATE_CACHE_MAX_ENTRIES, AGGREGATE_CACHE_TTL)
+
+# Identical searches and reads that miss the cache while one is already in
+# flight wait for that fan-out instead of starting their own
+search_flights = SingleFlight("search")
+read_flights = SingleFlight("read")
+aggregate_flights = SingleFlight("aggregate")
+
+background_tasks = []
+
+CACHE_HIT_RATIO.set_function(lambda: response_cache.stats()['hit_ratio'])
+CACHE_ENTRIES.set_function(lambda: len(response_cache.entries))
+
+@app.on_event("startup")
+async def startup():
+    global http_client
+    http_client = create_client()
+    if LOCATION_SCAN_INTERVAL >= 0:
+        background_tasks.append(asyncio.create_task(
+            scan_periodically(http_client, registry.servers, LOCATION_SCAN_INTERVAL)
+        ))
+    if HEALTH_PROBE_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(
+            probe_periodically(http_client, registry.servers, HEALTH_PROBE_INTERVAL)
+        ))
+    if CAPABILITY_REFRESH_INTERVAL >= 0:
+        background_tasks.append(asyncio.create_task(
+            refresh_periodically(http_client, registry.servers, CAPABILITY_REFRESH_INTERVAL)
+        ))
+    if VIEW_SYNC_INTERVAL >= 0:
+        background_tasks.append(asyncio.create_task(
+            sync_periodically(http_client, registry.servers, VIEW_SYNC_INTERVAL)
+        ))
+    if REGISTRY_RELOAD_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(registry.watch(REGISTRY_RELOAD_INTERVAL)))
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await http_client.aclose()
+
+async def query_server(server: Dict[str, Any], resource_type: str, search_params: Dict[str, str]) -> Optional[Dict[Any, Any]]:
+    """
+    Search a single FHIR server and return its Bundle, or None if the request failed
+    """
+    try:
+        url = build_search_url(server, resource_type, search_params)
+        with upstream_span(server, url):
+            response = await get_from(http_client, server, url)
+
+            if response.status_code == 200:
+                bundle = orjson.loads(response.content)
+                record_entries(bundle.get('entry', []))
+                return bundle
+
+    except httpx.HTTPError as e:
+        print(f"Error querying {server['name']}: {str(e)}")
+
+    return None
+
+@traced("search_with_params")
 async def search_with_params(resource_type: str, search_params: Dict[str, str]) -> Optional[Dict[Any, Any]]:
     """
-    Search for resources across all FHIR servers using search parameters
+    Search for resources across all FHIR servers using search parameters.
+
+    All healthy servers that may hold the resource type (see capabilities)
+    are queried concurrently; results are then checked in priority order and
+    the first Bundle with matches wins. Lower-priority requests that are
+    still running once a winner is found are cancelled. Servers last counted
+    as having none of the type are only queried, the same way, if no other
+    server has matches.
+    Higher-priority servers that were down or failed are reported in an
+    OperationOutcome entry, since they might have held better matches.
     """
-    for server in sorted(FHIR_SERVERS, key=lambda x: x['priority']):
+    phases = routing_table.phases(resource_type)
+    unavailable = []
+
+    for phase, servers in enumerate(phases):
+        tasks = {
+            server['name']: asyncio.create_task(query_server(server, resource_type, search_params))
+            for server in server_health.route(servers)
+        }
         try:
-            # Construct the search URL with parameters
-            base_url = f"{server['url']}/{resource_type}"
-            if search_params:
-                query_string = urlencode(search_params)
-                url = f"{base_url}?{query_string}"
-            else:
-                url = base_url
-
-            response = requests.get(
-                url,
-                headers={"Accept": "application/fhir+json"}
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
+            for server in servers:
+                task = tasks.get(server['name'])
+                result = await task if task else None
                 # Check if we got any matches
-                if result.get('total', 0) > 0:
-                    # Add source server information
-                    for entry in result.get('entry', []):
-                        if 'resource' in entry:
-                            entry['resource']['meta'] = entry['resource'].get('meta', {})
-                            entry['resource']['meta']['source'] = server['name']
+                if result and result.get('total', 0) > 0:
+                    tag_source(result.get('entry', []), server['name'])
+                    result['meta'] = result.get('meta', {})
+                    result['meta']['source'] = server['name']
+                    outcome = outcome_entry(unavailable)
+                    if outcome:
+                        result['entry'] = result.get('entry', []) + [outcome]
+                    for later in phases[phase + 1:]:
+                        routing_table.skip(later)
                     return result
-                
-        except requests.RequestException as e:
-            print(f"Error querying {server['name']}: {str(e)}")
-            continue
-            
+                if result is None:
+                    unavailable.append(server['name'])
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    return None
+
+async def open_stream(server: Dict[str, Any], resource_type: str, search_params: Dict[str, str]) -> Optional[StreamedBundle]:
+    """
+    Start a search on a single server and parse its Bundle up to the entry
+    array, or return None if the request failed. The response is left open
+    for the entries to be streamed.
+    """
+    response = None
+    try:
+        url = build_search_url(server, resource_type, search_params)
+        with upstream_span(server, url):
+            response = await stream_from(http_client, server, url)
+
+            if response.status_code == 200:
+                bundle = StreamedBundle(response)
+                await bundle.read_head()
+                return bundle
+
+    except (httpx.HTTPError, ijson.JSONError) as e:
+        print(f"Error querying {server['name']}: {str(e)}")
+    except asyncio.CancelledError:
+        if response is not None:
+            await response.aclose()
+        raise
+
+    if response is not None:
+        await response.aclose()
     return None
 
+@traced("stream_search")
+async def stream_search(resource_type: str, search_params: Dict[str, str]) -> Optional[Tuple[Dict[str, Any], StreamedBundle, List[str]]]:
+    """
+    Streaming counterpart of search_with_params. Healthy servers are queried
+    concurrently and checked in priority order as before, but only the head
+    of each Bundle is parsed. The winning server's response stays open so
+    its entries can be passed through to the client; every other response
+    is closed. Also returns the higher-priority servers that were unavailable.
+    """
+    phases = routing_table.phases(resource_type)
+    unavailable = []
+    winner = None
+
+    for phase, servers in enumerate(phases):
+        tasks = {
+            server['name']: asyncio.create_task(open_stream(server, resource_type, search_params))
+            for server in server_health.route(servers)
+        }
+        try:
+            for server in servers:
+                task = tasks.get(server['name'])
+                bundle = await task if task else None
+                if bundle and bundle.matches:
+                    winner = bundle
+                    for later in phases[phase + 1:]:
+                        routing_table.skip(later)
+                    return server, bundle, unavailable
+                if bundle is None:
+                    unavailable.append(server['name'])
+        finally:
+            for task in tasks.values():
+                task.cancel()
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    bundle = task.result()
+                    if bundle is not None and bundle is not winner:
+                        await bundle.aclose()
+
+    return None
+
+def should_stream(search_params: Dict[str, str]) -> bool:
+    """Whether a priority search asks for a page large enough to stream through"""
+    if STREAM_MIN_COUNT < 0:
+        return False
+    count = search_params.get('_count', '')
+    return STREAM_MIN_COUNT == 0 or (count.isdigit() and int(count) >= STREAM_MIN_COUNT)
+
+async def search_and_cache(resource_type: str, search_params: Dict[str, str]) -> Optional[Dict[Any, Any]]:
+    """search_with_params, caching the result if it is complete and has matches"""
+    result = await search_with_params(resource_type, search_params)
+    if result and result.get('total', 0) > 0 and not is_partial(result):
+        response_cache.put(resource_type, search_params, result)
+    return result
+
+async def cached_search(resource_type: str, search_params: Dict[str, str]) -> Optional[Dict[Any, Any]]:
+    """
+    search_with_params behind the response cache. Concurrent misses for the
+    same normalized search share a single fan-out.
+    """
+    result = response_cache.get(resource_type, search_params)
+    if result is None:
+        result = await search_flights.do(
+            cache_key(resource_type, search_params),
+            lambda: search_and_cache(resource_type, search_params)
+        )
+    return result
+
+def servers_before(resource_type: str, name: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+    """
+    The servers a priority search for the type asks before the named one,
+    in order; None if it would not ask that server at all
+    """
+    servers = routing_table.servers(resource_type)
+    names = [server['name'] for server in servers]
+    return servers[:names.index(name)] if name in names else None
+
+async def revalidate_resource(resource_type: str, id: str) -> Optional[Dict[Any, Any]]:
+    """
+    Revalidate an expired cached read against the server that owns the resource,
+    using its meta.versionId as an ETag. Returns None if there is nothing to
+    revalidate or the resource is gone, so the caller falls back to a full search.
+
+    Reads share their cache entry with _id searches, so a cached read must
+    stay what a priority search would return. Only an entry from the first
+    server in priority order is revalidated on its own; for any other, a
+    server before it may hold the id by now, so read_from_owner checks again.
+    """
+    params = {'_id': id}
+    stale = response_cache.get_stale(resource_type, params)
+    if not stale or not stale.get('entry'):
+        return None
+    server = registry.get(stale.get('meta', {}).get('source'))
+    if server is None or servers_before(resource_type, server['name']) != []:
+        return None
+    if not server_health.available(server['name']):
+        return None
+
+    entry = stale['entry'][0]
+    version = entry.get('resource', {}).get('meta', {}).get('versionId')
+    headers = {'If-None-Match': f'W/"{version}"'} if version else {}
+    url = f"{server_url(server)}/{resource_type}/{id}"
+    try:
+        with upstream_span(server, url):
+            response = await get_from(http_client, server, url, headers=headers)
+    except httpx.HTTPError as e:
+        print(f"Error revalidating {resource_type}/{id} on {server['name']}: {str(e)}")
+        return None
+
+    if response.status_code == 304:
+        response_cache.revalidated(resource_type, params)
+        return stale
+    if response.status_code == 200:
+        updated_entry = {**entry, 'resource': orjson.loads(response.content)}
+        tag_source([updated_entry], server['name'])
+        result = {**stale, 'entry': [updated_entry]}
+        response_cache.put(resource_type, params, result)
+        return result
+
+    response_cache.pop(resource_type, params)
+    return None
+
+async def read_from(server: Dict[str, Any], resource_type: str, id: str) -> Optional[httpx.Response]:
+    """Read a resource from one server; None if the request failed"""
+    url = f"{server_url(server)}/{resource_type}/{id}"
+    try:
+        with upstream_span(server, url):
+            return await get_from(http_client, server, url)
+    except httpx.HTTPError as e:
+        print(f"Error reading {resource_type}/{id} from {server['name']}: {str(e)}")
+        return None
+
+async def read_from_owner(resource_type: str, id: str) -> Optional[Dict[Any, Any]]:
+    """
+    Read a resource directly from the server the location index says owns it,
+    wrapped in a searchset Bundle like an _id search would return.
+
+    Ids are assigned per server, so the same id usually exists on several of
+    them, and an _id search answers from the first in priority order that
+    has it. The index may have learnt a later one (from a merge search, say),
+    so the servers before the owner are read alongside it and the first of
+    them that has the id answers instead. If any of them is unavailable or
+    fails, None is returned and the caller's fallback search decides; if none
+    has the id, the stale location is removed so that search can re-learn it.
+    """
+    owner = location_index.lookup(resource_type, id)
+    before = servers_before(resource_type, owner)
+    if before is None:
+        return None
+    servers = before + [registry.get(owner)]
+    if not all(server_health.available(server['name']) for server in servers):
+        return None
+
+    responses = await asyncio.gather(*(read_from(server, resource_type, id) for server in servers))
+    for server, response in zip(servers, responses):
+        if response is None:
+            return None
+        if response.status_code == 200:
+            location_index.record(resource_type, id, server['name'])
+            entries = [{"fullUrl": str(response.request.url), "resource": orjson.loads(response.content), "search": {"mode": "match"}}]
+            tag_source(entries, server['name'])
+            return {
+                "resourceType": "Bundle",
+                "type": "searchset",
+                "meta": {"source": server['name']},
+                "total": 1,
+                "entry": entries
+            }
+        # 410 is a deleted resource, which an _id search does not match either
+        if response.status_code not in (404, 410):
+            return None
+
+    location_index.forget(resource_type, id)
+    return None
+
+def cursor_url(request: Request, pages: Dict[str, Any], total: Optional[int], path: Optional[str] = None,
+               order: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """
+    Build a next link served by this service for the given upstream paging
+    state, on the request's own path unless another path is given
+    """
+    if not pages:
+        return None
+    token = encode_cursor(pages, total, order)
+    url = request.url.replace(path=path) if path else request.url
+    return str(url.replace(query=urlencode({'_cursor': token})))
+
+def paged_bundle(request: Request, entries: list, pages: Dict[str, Any], total: Optional[int],
+                 order: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Wrap one federated page of entries in a searchset Bundle"""
+    bundle = {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "link": paged_links(str(request.url), cursor_url(request, pages, total, order=order)),
+        "entry": entries
+    }
+    if total is not None:
+        bundle["total"] = total
+    return bundle
+
+async def sorted_bundle(request: Request, sources: List[SortedSource], order: Dict[str, Any],
+                        total: Optional[int] = None) -> Dict[str, Any]:
+    """One page of a sorted merge-mode search; total is the first page's, when continuing from a cursor"""
+    try:
+        sort, count = parse_sort(str(order['sort'])), int(order['count'])
+        if count < 1:
+            raise ValueError("_count must be positive")
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid _sort or _count: {str(e)}")
+    entries, pages, upstream_total = await sorted_page(http_client, sources, sort, count)
+    return paged_bundle(request, entries, pages, upstream_total if total is None else total, order)
+
+def not_found(detail: str) -> HTTPException:
+    """404 for a search that found nothing, or 503 if every server is being skipped as unhealthy"""
+    if all(server_health.down(server['name']) for server in registry.servers()):
+        return HTTPException(status_code=503, detail="No FHIR server is currently available")
+    return HTTPException(status_code=404, detail=detail)
+
 @app.get("/fhir/{resource_type}")
+@traced("search_resources")
 async def search_resources(request: Request, resource_type: str):
     """
-    Endpoint to search for resources with parameters across all FHIR servers
+    Endpoint to search for resources with parameters across all FHIR servers.
+
+    By default the first server with matches (in priority order) answers.
+    With _federation=merge, results from every server are streamed back as
+    one combined Bundle, or returned one federated page at a time when _count
+    is given. A merge-mode _sort merges the servers' sorted pages into one
+    order, a page of _count at a time. Next links carry an opaque _cursor token holding each server's
+    upstream paging state, so clients never talk to the backends directly.
+    Priority searches for large pages (see STREAM_MIN_COUNT) bypass the cache
+    and stream the winning server's Bundle through entry by entry.
+    Other priority searches resolve _include and _revinclude across servers.
     """
     # Get all query parameters from the request
     search_params = dict(request.query_params)
+    federation_mode = search_params.pop('_federation', 'priority')
+    cursor = search_params.pop('_cursor', None)
+
+    if cursor:
+        try:
+            pages, total, order = decode_cursor(cursor)
+            sources = cursor_sources(registry.servers(), pages) if order else None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if order:
+            return await sorted_bundle(request, sources, order, total)
+        entries, next_pages, _ = await federated_page(http_client, cursor_requests(registry.servers(), pages))
+        return paged_bundle(request, entries, next_pages, total)
+
+    if federation_mode == 'merge':
+        servers = routing_table.servers(resource_type)
+        if '_sort' in search_params:
+            order = {'sort': search_params['_sort'], 'count': search_params.get('_count', SORT_DEFAULT_COUNT)}
+            search_params['_count'] = str(order['count'])
+            return await sorted_bundle(request, search_sources(servers, resource_type, search_params), order)
+        if '_count' in search_params:
+            entries, next_pages, total = await federated_page(http_client, [
+                (server, build_search_url(server, resource_type, search_params))
+                for server in servers
+            ])
+            return paged_bundle(request, entries, next_pages, total)
+        return StreamingResponse(
+            merged_bundle(http_client, servers, resource_type, search_params, tracer.start_span("merged_bundle")),
+            media_type="application/fhir+json"
+        )
     
-    result = await search_with_params(resource_type, search_params)
+    if should_stream(search_params):
+        found = await stream_search(resource_type, search_params)
+        if found is None:
+            raise not_found(f"No {resource_type} resources found matching the criteria")
+        server, bundle, unavailable = found
+
+        def links(head: Dict[str, Any]) -> List[Dict[str, str]]:
+            upstream_next = next_link(head)
+            pages = {server['name']: page_query(upstream_next)} if upstream_next else {}
+            return paged_links(str(request.url), cursor_url(request, pages, head.get('total')))
+
+        return StreamingResponse(
+            passthrough(bundle, server['name'], links, outcome_entry(unavailable), tracer.start_span("passthrough")),
+            media_type="application/fhir+json"
+        )
+
+    return await search_bundle(
+        request, resource_type, search_params, str(request.url),
+        request.query_params.getlist('_include'), request.query_params.getlist('_revinclude')
+    )
+
+async def search_bundle(request: Request, resource_type: str, search_params: Dict[str, str], self_url: str,
+                        includes: Sequence[str] = (), revincludes: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Cached priority search with upstream links replaced by links to this
+    service, and includes resolved across servers. Raises 404 if no server
+    has matches.
+    """
+    result = await cached_search(resource_type, search_params)
     
     if result and result.get('total', 0) > 0:
+        # Replace upstream links, which point at internal hosts, with cursor links.
+        # The result may be shared through the cache, so the links go on a copy.
+        result = dict(result)
+        upstream_next = next_link(result)
+        pages = {result['meta']['source']: page_query(upstream_next)} if upstream_next else {}
+        next_url = cursor_url(request, pages, result.get('total'), f"/fhir/{resource_type}")
+        result['link'] = paged_links(self_url, next_url)
+        if includes or revincludes:
+            included = await federated_includes(http_client, result, includes, revincludes)
+            result['entry'] = result.get('entry', []) + included
         return result
     else:
-        raise HTTPException(
-            status_code=404,
-            detail=f"No {resource_type} resources found matching the criteria"
-        )
+        raise not_found(f"No {resource_type} resources found matching the criteria")
+
+async def load_resource(resource_type: str, id: str) -> Optional[Dict[Any, Any]]:
+    """
+    Fill a cache miss for a read: revalidate an expired entry, read from the
+    owning server, or fall back to searching every server. Each of these
+    answers like a priority _id search, whose cache entry the result fills.
+    """
+    params = {'_id': id}
+    result = await revalidate_resource(resource_type, id)
+    if result is None:
+        result = await read_from_owner(resource_type, id)
+        if result is None:
+            result = await search_with_params(resource_type, params)
+        if result and result.get('total', 0) > 0 and not is_partial(result):
+            response_cache.put(resource_type, params, result)
+    return result
 
 @app.get("/fhir/{resource_type}/{id}")
+@traced("get_resource")
 async def get_resource(resource_type: str, id: str):
     """
-    Endpoint to search for a specific resource by ID across all FHIR servers
+    Endpoint to search for a specific resource by ID across all FHIR servers.
+    Reads are served from the response cache, revalidating expired entries
+    with the owning server. Otherwise the location index routes the read to
+    the owning server (see read_from_owner), and only unknown IDs fall back
+    to a full search.
+    Concurrent misses for the same resource share one load.
     """
-    result = await search_with_params(resource_type, {'_id': id})
+    result = response_cache.get(resource_type, {'_id': id})
+    if result is None:
+        result = await read_flights.do(
+            (resource_type, id),
+            lambda: load_resource(resource_type, id)
+        )
     
     if result and result.get('total', 0) > 0:
         return result
     else:
+        raise not_found(f"Resource {resource_type}/{id} not found in any server")
+
+@app.get("/fhir/Patient/{id}/$everything-federated")
+@traced("everything_federated")
+async def everything_federated(id: str):
+    """
+    A Patient together with the fetal Patients linked to it and all of their
+    Observations, DiagnosticReports, CarePlans and RiskAssessments from every
+    server, streamed back as one Bundle in place of a call per type and server.
+    """
+    result = await get_resource("Patient", id)
+    return StreamingResponse(
+        everything_bundle(http_client, result['entry'][0], tracer.start_span("everything_bundle")),
+        media_type="application/fhir+json"
+    )
+
+def operation_outcome(detail: str) -> Dict[str, Any]:
+    return {
+        "resourceType": "OperationOutcome",
+        "issue": [{"severity": "error", "code": "processing", "diagnostics": detail}]
+    }
+
+def response_entry(status: int, resource: Dict[str, Any]) -> Dict[str, Any]:
+    """An entry of a batch-response Bundle"""
+    return {
+        "resource": resource,
+        "response": {"status": f"{status} {HTTPStatus(status).phrase}"}
+    }
+
+async def batch_entry(request: Request, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Answer one entry of a batch Bundle. Reads ('Patient/123') are answered
+    like GET /fhir/{type}/{id} but return the resource itself, and searches
+    ('Observation?subject=Patient/123') like a priority-mode GET /fhir/{type}.
+    """
+    method = entry.get('request', {}).get('method')
+    url = entry.get('request', {}).get('url', '')
+    if method != 'GET':
+        return response_entry(405, operation_outcome(f"Only GET entries are supported, not {method}"))
+
+    parts = urlsplit(url)
+    path = parts.path.strip('/').split('/')
+    try:
+        if len(path) == 2 and path[0] and path[1] and not parts.query:
+            result = await get_resource(path[0], path[1])
+            return response_entry(200, result['entry'][0]['resource'])
+        if len(path) == 1 and path[0]:
+            self_url = str(request.url.replace(path=f"/fhir/{path[0]}", query=parts.query))
+            query = parse_qsl(parts.query)
+            result = await search_bundle(
+                request, path[0], dict(query), self_url,
+                [value for key, value in query if key == '_include'],
+                [value for key, value in query if key == '_revinclude']
+            )
+            return response_entry(200, result)
+    except HTTPException as e:
+        return response_entry(e.status_code, operation_outcome(str(e.detail)))
+    return response_entry(400, operation_outcome(f"Unsupported request URL: {url}"))
+
+@app.post("/fhir")
+@traced("batch")
+async def batch(request: Request):
+    """
+    FHIR batch endpoint: POST a Bundle of type 'batch' with GET entries and
+    get back a 'batch-response' Bundle with one entry per request, in order.
+    Entries are answered concurrently, at most BATCH_CONCURRENCY at a time,
+    so a page that needs dozens of lookups costs one round trip.
+    """
+    try:
+        bundle = orjson.loads(await request.body())
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {str(e)}")
+    if not isinstance(bundle, dict) or bundle.get('resourceType') != 'Bundle' or bundle.get('type') != 'batch':
+        raise HTTPException(status_code=400, detail="Expected a Bundle of type batch")
+    entries = bundle.get('entry', [])
+    if len(entries) > BATCH_MAX_ENTRIES:
         raise HTTPException(
-            status_code=404,
-            detail=f"Resource {resource_type}/{id} not found in any server"
+            status_code=413,
+            detail=f"Batch has {len(entries)} entries, the limit is {BATCH_MAX_ENTRIES}"
+        )
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def answer(entry: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            return await batch_entry(request, entry)
+
+    return {
+        "resourceType": "Bundle",
+        "type": "batch-response",
+        "entry": await asyncio.gather(*(answer(entry) for entry in entries))
+    }
+
+@app.get("/aggregate/{resource_type}")
+@traced("aggregate")
+async def aggregate_resources(request: Request, resource_type: str):
+    """
+    Count the resources matching a search across all FHIR servers, for
+    dashboards. Without _group each server answers a _summary=count query;
+    _group=<path> (e.g. activity.detail.code) also counts them by the value
+    at that path, scanning the matches with _elements trimmed to it, and
+    _bucket=<width> groups numeric values into ranges. Results are cached for
+    AGGREGATE_CACHE_TTL seconds unless a server was unavailable, and
+    identical aggregates in flight are computed once.
+    """
+    search_params = dict(request.query_params)
+    group = search_params.pop('_group', None)
+    try:
+        bucket = float(search_params.pop('_bucket')) if '_bucket' in search_params else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="_bucket must be a number")
+    if bucket is not None and (not math.isfinite(bucket) or bucket <= 0):
+        raise HTTPException(status_code=400, detail="_bucket must be a positive number")
+
+    key_params = {**search_params, '_group': group or '', '_bucket': str(bucket or '')}
+    result = aggregate_cache.get(resource_type, key_params)
+    if result is None:
+        result = await aggregate_flights.do(
+            cache_key(resource_type, key_params),
+            lambda: aggregate(
+                http_client, routing_table.servers(resource_type), resource_type, search_params, group, bucket
+            )
         )
+        if not result['unavailable']:
+            aggregate_cache.put(resource_type, key_params, result)
+    return result
+
+@app.get("/view/Patient/{id}")
+async def patient_view(id: str, server: Optional[str] = None):
+    """
+    Key prenatal facts of a patient (latest vitals and gestational age,
+    delivery plan, risk factors) from the local materialized view, without
+    a call to any FHIR server. The view trails the servers by up to
+    VIEW_SYNC_INTERVAL seconds. server narrows the id to one server's Patient.
+    """
+    summary = await materialized_view.run(materialized_view.summary, id, server)
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f"No facts about Patient/{id} in the view")
+    return summary
+
+@app.get("/view/stats")
+async def view_stats():
+    """Facts held by the materialized view and how far it has synced each server"""
+    return await materialized_view.run(materialized_view.stats)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Response cache hit/miss counters"""
+    return {**response_cache.stats(), "aggregates": aggregate_cache.stats()}
+
+@app.get("/locations/stats")
+async def location_stats():
+    """Resource location index counters"""
+    return location_index.stats()
+
+@app.get("/singleflight/stats")
+async def singleflight_stats():
+    """Searches and reads that shared an in-flight fan-out instead of starting one"""
+    return {
+        "search": search_flights.stats(),
+        "read": read_flights.stats(),
+        "aggregate": aggregate_flights.stats()
+    }
+
+@app.get("/routing/stats")
+async def routing_stats():
+    """Resource types each server can hold, and how many searches skipped it"""
+    return routing_table.stats()
+
+@app.get("/servers/stats")
+async def server_stats():
+    """Circuit breaker state and last health probe of every upstream server"""
+    return server_health.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    for server in registry.servers():
+        UPSTREAM_UP.labels(server['name']).set(0 if server_health.down(server['name']) else 1)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/health/deep")
+async def deep_health_check():
+    """
+    Health check that probes every upstream server's /metadata. Healthy when
+    all servers answer, degraded when some do, and 503 when none do.
+    """
+    async def timed_probe(server: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.monotonic()
+        reachable = await probe(http_client, server)
+        return {
+            "reachable": reachable,
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            "breaker": server_health.breaker(server['name']).state
+        }
+
+    servers = registry.servers()
+    results = await asyncio.gather(*(timed_probe(server) for server in servers))
+    servers = {server['name']: result for server, result in zip(servers, results)}
+    reachable = sum(result['reachable'] for result in results)
+    if reachable == len(results):
+        status = "healthy"
+    elif reachable:
+        status = "degraded"
+    else:
+        status = "unhealthy"
+    return ORJSONResponse(
+        {"status": status, "servers": servers},
+        status_code=200 if reachable else 503
+    )
@@ -0,0 +1,225 @@
+import asyncio
+import heapq
+import re
+import httpx
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+from federation import tag_source, next_link
+from health import server_health, outcome_entry
+from pagination import fetch_page, page_query
+from registry import server_url
+
+# A sorted cursor's page path: a resource type, or empty for an upstream next link
+CURSOR_PATH = re.compile(r'[A-Za-z]*')
+
+# Elements a sort parameter orders by when it is not named after one, in order of preference
+SORT_ELEMENTS = {
+    'date': ('effectiveDateTime', 'effectivePeriod.start', 'effectiveInstant', 'occurrenceDateTime',
+             'occurrencePeriod.start', 'period.start', 'authoredOn', 'issued', 'date'),
+    'birthdate': ('birthDate',),
+    '_lastUpdated': ('meta.lastUpdated',),
+    '_id': ('id',)
+}
+
+def parse_sort(value: str) -> List[Tuple[str, bool]]:
+    """Split a _sort value like '-date,code' into (parameter, descending) pairs"""
+    return [
+        (parameter.lstrip('-'), parameter.startswith('-'))
+        for parameter in value.split(',') if parameter.strip('-')
+    ]
+
+def element(resource: Dict[str, Any], path: str) -> Any:
+    value: Any = resource
+    for name in path.split('.'):
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+def comparable(value: Any) -> Optional[Tuple[int, Any]]:
+    """
+    A value that orders like the upstream servers do: dates and times as
+    instants (naive ones taken as UTC), numbers as numbers, codes and
+    quantities by their code or value, anything else as text
+    """
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        coding = value.get('coding')
+        value = coding[0].get('code') if coding else value.get('value', value.get('code', value.get('text')))
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (0, value)
+    value = str(value)
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return (1, value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (0, moment.timestamp())
+
+class SortKey:
+    """
+    Orders resources by a parsed _sort. Resources missing a value sort last
+    in either direction, as HAPI does.
+    """
+
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, resource: Dict[str, Any], sort: List[Tuple[str, bool]]):
+        self.values = [
+            next((
+                value for value in (comparable(element(resource, path)) for path in SORT_ELEMENTS.get(parameter, (parameter,)))
+                if value is not None
+            ), None)
+            for parameter, _ in sort
+        ]
+        self.descending = [descending for _, descending in sort]
+
+    def __eq__(self, other: 'SortKey') -> bool:
+        return self.values == other.values
+
+    def __lt__(self, other: 'SortKey') -> bool:
+        for value, other_value, descending in zip(self.values, other.values, self.descending):
+            if value == other_value:
+                continue
+            if value is None or other_value is None:
+                return other_value is None
+            if value[0] != other_value[0]:
+                return value[0] < other_value[0]
+            return value > other_value if descending else value < other_value
+        return False
+
+class SortedSource:
+    """
+    One server's results in upstream sort order, read a page at a time. The
+    page is addressed by a path under the server's base URL (empty for
+    upstream next links) and a query, and offset counts the entries of it
+    already returned, so a cursor can resume in the middle of a page.
+    """
+
+    def __init__(self, server: Dict[str, Any], path: str, query: str, offset: int = 0):
+        self.server = server
+        self.path = path
+        self.query = query
+        self.offset = offset
+        self.entries: List[Dict[str, Any]] = []
+        self.next_url: Optional[str] = None
+        self.total: Optional[int] = None
+        self.failed = False
+
+    def url(self) -> str:
+        base_url = server_url(self.server)
+        return f"{base_url}/{self.path}?{self.query}" if self.path else f"{base_url}?{self.query}"
+
+    async def load(self, client: httpx.AsyncClient) -> bool:
+        bundle = await fetch_page(client, self.server, self.url())
+        if bundle is None:
+            self.failed = True
+            return False
+        self.entries = [
+            entry for entry in bundle.get('entry', [])
+            if 'resource' in entry and entry.get('search', {}).get('mode') != 'outcome'
+        ]
+        tag_source(self.entries, self.server['name'])
+        self.next_url = next_link(bundle)
+        self.total = bundle.get('total')
+        return True
+
+    def head(self) -> Optional[Dict[str, Any]]:
+        return self.entries[self.offset] if self.offset < len(self.entries) else None
+
+    async def fill(self, client: httpx.AsyncClient) -> bool:
+        """Fetch further pages until an unread entry is buffered; returns False once there are none"""
+        while self.head() is None:
+            if not self.next_url:
+                return False
+            self.path, self.query, self.offset = '', page_query(self.next_url), 0
+            if not await self.load(client):
+                return False
+        return True
+
+    def state(self) -> Optional[List[Any]]:
+        """Where the next page of this server's results starts, for a cursor; None when it has no more"""
+        if self.head() is not None:
+            return [self.path, self.query, self.offset]
+        if self.next_url:
+            return ['', page_query(self.next_url), 0]
+        return None
+
+def search_sources(servers: List[Dict[str, Any]], resource_type: str, search_params: Dict[str, str]) -> List[SortedSource]:
+    return [SortedSource(server, resource_type, urlencode(search_params)) for server in servers]
+
+def cursor_sources(servers: List[Dict[str, Any]], pages: Dict[str, Any]) -> List[SortedSource]:
+    """Sources resuming where a sorted cursor left off, raising ValueError if it is malformed"""
+    by_name = {server['name']: server for server in servers}
+    sources = []
+    for name, state in pages.items():
+        if name not in by_name:
+            continue
+        try:
+            path, query, offset = state
+            # The cursor comes from the client, so it must not reach anything but a search
+            if not isinstance(path, str) or not CURSOR_PATH.fullmatch(path):
+                raise ValueError
+            sources.append(SortedSource(by_name[name], str(path), str(query), int(offset)))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid cursor: bad paging state for {name}")
+    return sources
+
+async def sorted_page(client: httpx.AsyncClient, sources: List[SortedSource], sort: List[Tuple[str, bool]],
+                      count: int) -> Tuple[List[Dict[str, Any]], Dict[str, List[Any]], int]:
+    """
+    The next count results across servers in _sort order, by a k-way merge of
+    their already-sorted pages. Each server's current page is fetched up
+    front; after that a server's next page is only fetched once the merge has
+    used up the one before, so a page of K results costs O(K log S) and at
+    most a page per server beyond what is returned.
+
+    Returns the source-tagged entries (de-duplicated by fullUrl), each
+    server's paging state for a cursor, and the sum of the upstream totals.
+    Servers that are down or fail are listed in an OperationOutcome entry.
+    """
+    available = [source for source in sources if server_health.available(source.server['name'])]
+    failed = [source.server['name'] for source in sources if source not in available]
+    await asyncio.gather(*(source.load(client) for source in available))
+
+    heap: List[Tuple[SortKey, int, SortedSource]] = []
+
+    async def push(index: int, source: SortedSource) -> None:
+        if await source.fill(client):
+            heapq.heappush(heap, (SortKey(source.head()['resource'], sort), index, source))
+
+    for index, source in enumerate(available):
+        if not source.failed:
+            await push(index, source)
+
+    entries = []
+    seen = set()
+    while heap and len(entries) < count:
+        _, index, source = heapq.heappop(heap)
+        entry = source.head()
+        source.offset += 1
+        full_url = entry.get('fullUrl')
+        if not full_url or full_url not in seen:
+            seen.add(full_url)
+            entries.append(entry)
+        if len(entries) < count:
+            await push(index, source)
+
+    pages = {}
+    for source in available:
+        if source.failed:
+            failed.append(source.server['name'])
+        elif source.state():
+            pages[source.server['name']] = source.state()
+    outcome = outcome_entry(failed)
+    if outcome:
+        entries.append(outcome)
+    total = sum(source.total or 0 for source in available)
+    return entries, pages, total
@@ -0,0 +1,136 @@
+import httpx
+import ijson
+import orjson
+from ijson.common import ObjectBuilder
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from federation import tag_source
+from opentelemetry import trace
+from opentelemetry.trace import Span
+from metrics import UPSTREAM_BYTES
+
+async def bundle_events(response: httpx.Response) -> AsyncIterator[Tuple[str, str, Any]]:
+    """Yield ijson (prefix, event, value) tuples as the upstream body arrives"""
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events, use_float=True)
+    async for chunk in response.aiter_bytes():
+        parser.send(chunk)
+        for event in events:
+            yield event
+        del events[:]
+    parser.close()
+    for event in events:
+        yield event
+
+class StreamedBundle:
+    """
+    A Bundle read incrementally from an open upstream response.
+
+    read_head() parses the top-level fields in front of the entry array (HAPI
+    writes total and link before the entries). entries() then yields one entry
+    at a time, and any fields after the array are collected in tail.
+    """
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+        self.events = bundle_events(response).__aiter__()
+        self.head: Dict[str, Any] = {}
+        self.tail: Dict[str, Any] = {}
+        self.has_entries = False
+
+    @property
+    def matches(self) -> bool:
+        """Whether the Bundle has results, going by total when the server sent one"""
+        total = self.head.get('total')
+        if total is not None:
+            return total > 0
+        return self.has_entries
+
+    async def build(self, first_event: Tuple[str, str, Any]) -> Any:
+        """Build the JSON value that starts with the given event"""
+        builder = ObjectBuilder()
+        _, event, value = first_event
+        depth = 0
+        while True:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+            if depth == 0:
+                return builder.value
+            _, event, value = await self.events.__anext__()
+
+    async def read_fields(self, fields: Dict[str, Any]) -> bool:
+        """
+        Read top-level fields into a dict until the entry array starts (returns
+        True) or the Bundle ends (returns False)
+        """
+        async for prefix, event, value in self.events:
+            if prefix == '' and event == 'map_key':
+                if value == 'entry':
+                    return True
+                fields[value] = await self.build(await self.events.__anext__())
+            elif prefix == '' and event == 'end_map':
+                return False
+        return False
+
+    async def read_head(self) -> None:
+        self.has_entries = await self.read_fields(self.head)
+
+    async def entries(self) -> AsyncIterator[Dict[str, Any]]:
+        async for prefix, event, value in self.events:
+            if prefix == 'entry.item' and event == 'start_map':
+                yield await self.build((prefix, event, value))
+            elif prefix == 'entry' and event == 'end_array':
+                break
+        await self.read_fields(self.tail)
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+
+def field(key: str, value: Any) -> bytes:
+    return orjson.dumps(key) + b':' + orjson.dumps(value)
+
+async def passthrough(bundle: StreamedBundle, server_name: str,
+                      links: Callable[[Dict[str, Any]], List[Dict[str, str]]],
+                      outcome: Optional[Dict[str, Any]] = None, span: Optional[Span] = None) -> AsyncIterator[bytes]:
+    """
+    Re-emit an upstream Bundle with meta.source set on it and on every entry,
+    and its links replaced by links(head). Entries are tagged and written out
+    as they are parsed, so only one is held in memory at a time. An outcome
+    entry, if given, is appended after the upstream entries. span, if given,
+    gets the entry count and body size and is ended with the stream.
+    """
+    span = span or trace.INVALID_SPAN
+    count = 0
+    try:
+        head = {
+            **bundle.head,
+            'meta': {**bundle.head.get('meta', {}), 'source': server_name},
+            'link': links(bundle.head)
+        }
+        yield b'{' + b','.join(field(key, value) for key, value in head.items())
+        if bundle.has_entries or outcome:
+            yield b',"entry":['
+            first = True
+            if bundle.has_entries:
+                async for entry in bundle.entries():
+                    tag_source([entry], server_name)
+                    chunk = orjson.dumps(entry)
+                    yield chunk if first else b',' + chunk
+                    first = False
+                    count += 1
+            if outcome:
+                chunk = orjson.dumps(outcome)
+                yield chunk if first else b',' + chunk
+            yield b']'
+        for key, value in bundle.tail.items():
+            if key not in head:
+                yield b',' + field(key, value)
+        yield b'}'
+    finally:
+        await bundle.aclose()
+        UPSTREAM_BYTES.labels(server_name).inc(bundle.response.num_bytes_downloaded)
+        span.set_attribute("fhir.entry_count", count)
+        span.set_attribute("http.response.body.size", bundle.response.num_bytes_downloaded)
+        span.end()
@@ -0,0 +1,101 @@
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+import httpx
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence
+from opentelemetry import trace
+from opentelemetry.propagate import extract, inject
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor, SimpleSpanProcessor, SpanExporter, SpanExportResult
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import Span, SpanKind
+from config import TRACE_EXPORTER, TRACE_FILE
+
+class FileSpanExporter(SpanExporter):
+    """Append finished spans to a file, one JSON object per line"""
+
+    def __init__(self, path: str):
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        with self.lock:
+            for span in spans:
+                self.file.write(span.to_json(indent=None) + "\n")
+            self.file.flush()
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        self.file.close()
+
+def configure_tracing(exporter_name: str, path: str) -> Optional[SpanExporter]:
+    """
+    Install a tracer provider exporting to a file ('file') or keeping spans in
+    memory ('memory', for tests). Any other value leaves tracing off, in which
+    case spans are no-ops and no trace headers are sent upstream.
+    """
+    if exporter_name == "file":
+        exporter = FileSpanExporter(path)
+        processor = BatchSpanProcessor(exporter)
+    elif exporter_name == "memory":
+        exporter = InMemorySpanExporter()
+        processor = SimpleSpanProcessor(exporter)
+    else:
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": "fhir-search-service"}))
+    provider.add_span_processor(processor)
+    trace.set_tracer_provider(provider)
+    return exporter
+
+exporter = configure_tracing(TRACE_EXPORTER, TRACE_FILE)
+tracer = trace.get_tracer("search-service")
+
+def traced(name: str) -> Callable:
+    """
+    Decorator running an async function in a span. resource_type and id
+    arguments become span attributes, and a request argument's incoming
+    trace context (traceparent header) becomes the parent.
+    """
+    def decorator(func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            request = arguments.get('request')
+            context = extract(request.headers) if request is not None else None
+            with tracer.start_as_current_span(name, context=context) as span:
+                for key in ('resource_type', 'id'):
+                    if key in arguments:
+                        span.set_attribute(f"fhir.{key}", arguments[key])
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def upstream_span(server: Dict[str, Any], url: str) -> Iterator[Span]:
+    """Client span around one call to an upstream server"""
+    with tracer.start_as_current_span(f"GET {server['name']}", kind=SpanKind.CLIENT) as span:
+        span.set_attribute("fhir.server", server['name'])
+        span.set_attribute("http.url", url)
+        yield span
+
+def trace_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Copy of headers with the current trace context (traceparent) added"""
+    headers = dict(headers or {})
+    inject(headers)
+    return headers
+
+def record_response(response: httpx.Response) -> None:
+    """Add status and, once the body has been read, its size to the current span"""
+    span = trace.get_current_span()
+    span.set_attribute("http.status_code", response.status_code)
+    if response.is_closed:
+        span.set_attribute("http.response.body.size", response.num_bytes_downloaded)
+
+def record_entries(entries: Sequence[Any]) -> None:
+    trace.get_current_span().set_attribute("fhir.entry_count", len(entries))
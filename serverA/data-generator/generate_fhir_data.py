@@ -1,14 +1,21 @@
-import requests
-import json
+import os
+import sys
 from datetime import datetime, timedelta
 import random
 import names
+# The FHIR client and the command line shared by every server's generator live
+# in generator-common, next to the server directories (also inside the image)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "generator-common"))
+import generator_cli
+from fhir_client import transaction_entry
+from timeline import pregnancy_start, visits, fhir_datetime
+from synthetic import Template, slot, identified, decimals
 
-BASE_URL = "http://maternal-fhir:8080/fhir"
+BASE_URL = os.getenv("FHIR_BASE_URL", "http://maternal-fhir:8080/fhir")
 
-def create_patient():
-    """Create a pregnant patient and return their ID"""
-    patient_data = {
+def build_patient():
+    """Build a pregnant patient resource"""
+    return {
         "resourceType": "Patient",
         "active": True,
         "name": [
@@ -27,22 +34,11 @@ def create_patient():
             }
         ]
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/Patient",
-        headers={"Content-Type": "application/fhir+json"},
-        json=patient_data
-    )
-    
-    if response.status_code == 201:
-        return response.json()["id"]
-    else:
-        raise Exception(f"Failed to create patient: {response.text}")
 
-def create_pregnancy_observation(patient_id):
-    """Record pregnancy status and gestational age"""
+def build_pregnancy_observation(patient_ref):
+    """Build the pregnancy status and gestational age observation"""
     gestational_weeks = random.randint(8, 40)
-    pregnancy_data = {
+    return {
         "resourceType": "Observation",
         "status": "final",
         "code": {
@@ -55,7 +51,7 @@ def create_pregnancy_observation(patient_id):
             ]
         },
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "valueCodeableConcept": {
@@ -87,17 +83,9 @@ def create_pregnancy_observation(patient_id):
             }
         ]
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/Observation",
-        headers={"Content-Type": "application/fhir+json"},
-        json=pregnancy_data
-    )
-    
-    return response.status_code == 201
 
-def create_vital_signs(patient_id):
-    """Record maternal vital signs"""
+def build_vital_signs(patient_ref):
+    """Build maternal vital sign observations"""
     vitals = [
         # Blood Pressure
         {
@@ -185,9 +173,8 @@ def create_vital_signs(patient_id):
         }
     ]
     
-    success = True
-    for vital in vitals:
-        observation = {
+    return [
+        {
             "resourceType": "Observation",
             "status": "final",
             "category": [
@@ -201,26 +188,15 @@ def create_vital_signs(patient_id):
                 }
             ],
             "subject": {
-                "reference": f"Patient/{patient_id}"
+                "reference": patient_ref
             },
             "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
             **vital
-        }
-        
-        response = requests.post(
-            f"{BASE_URL}/Observation",
-            headers={"Content-Type": "application/fhir+json"},
-            json=observation
-        )
-        
-        if response.status_code != 201:
-            success = False
-            print(f"Failed to create vital sign: {response.text}")
-    
-    return success
+        } for vital in vitals
+    ]
 
-def create_lab_results(patient_id):
-    """Record maternal lab results"""
+def build_lab_results(patient_ref):
+    """Build maternal lab result observations"""
     lab_tests = [
         # Hemoglobin
         {
@@ -260,9 +236,8 @@ def create_lab_results(patient_id):
         }
     ]
     
-    success = True
-    for lab_test in lab_tests:
-        observation = {
+    return [
+        {
             "resourceType": "Observation",
             "status": "final",
             "category": [
@@ -276,26 +251,15 @@ def create_lab_results(patient_id):
                 }
             ],
             "subject": {
-                "reference": f"Patient/{patient_id}"
+                "reference": patient_ref
             },
             "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
             **lab_test
-        }
-        
-        response = requests.post(
-            f"{BASE_URL}/Observation",
-            headers={"Content-Type": "application/fhir+json"},
-            json=observation
-        )
-        
-        if response.status_code != 201:
-            success = False
-            print(f"Failed to create lab result: {response.text}")
-    
-    return success
+        } for lab_test in lab_tests
+    ]
 
-def create_medication_statement(patient_id):
-    """Record maternal medications"""
+def build_medication_statements(patient_ref):
+    """Build maternal medication statements"""
     medications = [
         {
             "code": {
@@ -323,13 +287,12 @@ def create_medication_statement(patient_id):
         }
     ]
     
-    success = True
-    for medication in medications:
-        med_statement = {
+    return [
+        {
             "resourceType": "MedicationStatement",
             "status": "active",
             "subject": {
-                "reference": f"Patient/{patient_id}"
+                "reference": patient_ref
             },
             "medicationCodeableConcept": medication["code"],
             "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
@@ -338,52 +301,120 @@ def create_medication_statement(patient_id):
                     "text": medication["dosage"]
                 }
             ]
-        }
+        } for medication in medications
+    ]
+
+def build_patient_entries(patient_id=None):
+    """
+    Build the transaction entries for one patient and all of their records.
+    The records reference the Patient through its urn:uuid fullUrl. Passing
+    patient_id creates the Patient with that id instead of a server-assigned one.
+    """
+    patient_entry = transaction_entry(build_patient(), resource_id=patient_id)
+    patient_ref = patient_entry["fullUrl"]
+    resources = [
+        build_pregnancy_observation(patient_ref),
+        *build_vital_signs(patient_ref),
+        *build_lab_results(patient_ref),
+        *build_medication_statements(patient_ref)
+    ]
+    return [patient_entry] + [transaction_entry(resource) for resource in resources]
+
+def build_longitudinal_entries(schedule, reference_time):
+    """
+    Yield the transaction entries for one patient followed from conception to
+    delivery: pregnancy status and vital signs at every scheduled visit, with
+    weight tracking gestation, plus medications and lab results at booking
+    and lab results again at the 28-week screen
+    """
+    start = pregnancy_start(reference_time)
+    patient_entry = transaction_entry(build_patient())
+    patient_ref = patient_entry["fullUrl"]
+    yield patient_entry
+    
+    baseline_weight = random.uniform(50.0, 85.0)
+    baseline_systolic = random.randint(100, 130)
+    baseline_diastolic = random.randint(60, 85)
+    booking = True
+    for week, moment in visits(start, schedule, reference_time):
+        pregnancy = build_pregnancy_observation(patient_ref)
+        pregnancy["component"][0]["valueQuantity"]["value"] = week
         
-        response = requests.post(
-            f"{BASE_URL}/MedicationStatement",
-            headers={"Content-Type": "application/fhir+json"},
-            json=med_statement
-        )
+        blood_pressure, weight, heart_rate = build_vital_signs(patient_ref)
+        blood_pressure["component"][0]["valueQuantity"]["value"] = baseline_systolic + random.randint(-8, 8)
+        blood_pressure["component"][1]["valueQuantity"]["value"] = baseline_diastolic + random.randint(-5, 5)
+        # Roughly 0.4 kg/week of gain after the first trimester
+        weight["valueQuantity"]["value"] = round(baseline_weight + 0.4 * max(0, week - 13) + random.uniform(-0.5, 0.5), 1)
         
-        if response.status_code != 201:
-            success = False
-            print(f"Failed to create medication statement: {response.text}")
-    
-    return success
+        resources = [pregnancy, blood_pressure, weight, heart_rate]
+        if booking or week == 28:
+            resources.extend(build_lab_results(patient_ref))
+        if booking:
+            resources.extend(build_medication_statements(patient_ref))
+            booking = False
+        
+        for resource in resources:
+            resource["effectiveDateTime"] = fhir_datetime(moment)
+            yield transaction_entry(resource)
 
-def main():
-    """Generate test data for maternal health monitoring"""
-    print("Starting maternal health data generation...")
-    
-    for i in range(5):  # Generate data for 5 patients
-        try:
-            # Create patient
-            patient_id = create_patient()
-            print(f"Created patient {i+1}/5 with ID: {patient_id}")
-            
-            # Record pregnancy status
-            if create_pregnancy_observation(patient_id):
-                print(f"Recorded pregnancy status for patient {patient_id}")
-            
-            # Record vital signs
-            if create_vital_signs(patient_id):
-                print(f"Recorded vital signs for patient {patient_id}")
-            
-            # Record lab results
-            if create_lab_results(patient_id):
-                print(f"Recorded lab results for patient {patient_id}")
-            
-            # Record medications
-            if create_medication_statement(patient_id):
-                print(f"Recorded medications for patient {patient_id}")
-            
-            print("---")
-            
-        except Exception as e:
-            print(f"Error processing patient {i+1}: {str(e)}")
-    
-    print("Maternal health data generation complete!")
+def build_templates():
+    """
+    Resource templates for the vectorized engine, derived from the builders
+    above so both engines produce the same resource shapes
+    """
+    patient = identified(build_patient())
+    patient["name"][0]["family"] = slot("family")
+    patient["name"][0]["given"] = [slot("given")]
+    patient["birthDate"] = slot("birth_date")
+    patient["identifier"][0]["value"] = slot("identifier")
+
+    pregnancy = build_pregnancy_observation(slot("subject"))
+    pregnancy["component"][0]["valueQuantity"]["value"] = slot("gestational_weeks")
+
+    blood_pressure, weight, heart_rate = build_vital_signs(slot("subject"))
+    blood_pressure["component"][0]["valueQuantity"]["value"] = slot("systolic")
+    blood_pressure["component"][1]["valueQuantity"]["value"] = slot("diastolic")
+    weight["valueQuantity"]["value"] = slot("weight")
+    heart_rate["valueQuantity"]["value"] = slot("heart_rate")
+
+    hemoglobin, glucose = build_lab_results(slot("subject"))
+    hemoglobin["valueQuantity"]["value"] = slot("hemoglobin")
+    glucose["valueQuantity"]["value"] = slot("glucose")
+
+    folic_acid, prenatal_vitamins = build_medication_statements(slot("subject"))
+
+    records = [pregnancy, blood_pressure, weight, heart_rate, hemoglobin, glucose, folic_acid, prenatal_vitamins]
+    for resource in records:
+        resource["effectiveDateTime"] = slot("effective")
+    return Template(patient), [(resource["resourceType"], Template(identified(resource))) for resource in records]
+
+def build_rows(engine, n):
+    """
+    Template values for n patients of the vectorized engine: each value is
+    drawn for all n patients at once, then yielded per patient as the values
+    of the Patient and of its records
+    """
+    family = engine.names("last", n)
+    given = engine.names("first:female", n)
+    birth_date = engine.dates(-engine.integers(7300, 10950, n))  # Age between 20-30
+    identifier = engine.integers(10000, 99999, n)
+    gestational_weeks = engine.integers(8, 40, n)
+    systolic = engine.integers(100, 140, n)
+    diastolic = engine.integers(60, 90, n)
+    weight = decimals(engine.uniform(50.0, 85.0, n))
+    heart_rate = engine.integers(60, 100, n)
+    hemoglobin = decimals(engine.uniform(11.0, 15.0, n))
+    glucose = decimals(engine.uniform(70.0, 130.0, n))
+
+    for i in range(n):
+        yield {
+            "family": family[i], "given": given[i], "birth_date": birth_date[i],
+            "identifier": f'"MAT{identifier[i]}"'
+        }, {
+            "gestational_weeks": gestational_weeks[i], "systolic": systolic[i],
+            "diastolic": diastolic[i], "weight": weight[i], "heart_rate": heart_rate[i],
+            "hemoglobin": hemoglobin[i], "glucose": glucose[i]
+        }
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    generator_cli.main(sys.modules[__name__], "maternal health")
@@ -1,13 +1,21 @@
-import requests
-import json
-from datetime import datetime, timedelta
+import os
+import sys
+from datetime import datetime
 import random
 import names
+import numpy as np
+# The FHIR client and the command line shared by every server's generator live
+# in generator-common, next to the server directories (also inside the image)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "generator-common"))
+import generator_cli
+from fhir_client import transaction_entry
+from timeline import pregnancy_start, visits, fhir_datetime
+from synthetic import Template, slot, identified, decimals
 
-BASE_URL = "http://fetal-fhir:8080/fhir"
+BASE_URL = os.getenv("FHIR_BASE_URL", "http://fetal-fhir:8080/fhir")
 
-def create_patient(maternal_id=None):
-    """Create a fetus patient record linked to maternal ID"""
+def build_patient(maternal_ref=None):
+    """Build a fetus patient resource linked to the maternal record"""
     patient_data = {
         "resourceType": "Patient",
         "active": True,
@@ -27,29 +35,20 @@ def create_patient(maternal_id=None):
     }
     
     # Link to maternal record if provided
-    if maternal_id:
+    if maternal_ref:
         patient_data["link"] = [
             {
                 "other": {
-                    "reference": f"Patient/{maternal_id}"
+                    "reference": maternal_ref
                 },
                 "type": "seealso"
             }
         ]
     
-    response = requests.post(
-        f"{BASE_URL}/Patient",
-        headers={"Content-Type": "application/fhir+json"},
-        json=patient_data
-    )
-    
-    if response.status_code == 201:
-        return response.json()["id"]
-    else:
-        raise Exception(f"Failed to create patient: {response.text}")
+    return patient_data
 
-def create_fetal_measurements(patient_id, gestational_age):
-    """Record fetal measurements based on gestational age"""
+def build_fetal_measurements(patient_ref, gestational_age):
+    """Build fetal measurement observations based on gestational age"""
     
     # Calculate expected measurements based on gestational age
     # These are simplified estimates - in practice, you'd use proper growth charts
@@ -95,9 +94,8 @@ def create_fetal_measurements(patient_id, gestational_age):
         }
     ]
     
-    success = True
-    for measurement in measurements:
-        observation = {
+    return [
+        {
             "resourceType": "Observation",
             "status": "final",
             "category": [
@@ -111,27 +109,16 @@ def create_fetal_measurements(patient_id, gestational_age):
                 }
             ],
             "subject": {
-                "reference": f"Patient/{patient_id}"
+                "reference": patient_ref
             },
             "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
             **measurement
-        }
-        
-        response = requests.post(
-            f"{BASE_URL}/Observation",
-            headers={"Content-Type": "application/fhir+json"},
-            json=observation
-        )
-        
-        if response.status_code != 201:
-            success = False
-            print(f"Failed to create fetal measurement: {response.text}")
-    
-    return success
+        } for measurement in measurements
+    ]
 
-def create_fetal_heart_monitoring(patient_id):
-    """Record fetal heart rate monitoring"""
-    heart_rate = {
+def build_fetal_heart_monitoring(patient_ref):
+    """Build the fetal heart rate observation"""
+    return {
         "resourceType": "Observation",
         "status": "final",
         "category": [
@@ -154,7 +141,7 @@ def create_fetal_heart_monitoring(patient_id):
             ]
         },
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "valueQuantity": {
@@ -164,17 +151,9 @@ def create_fetal_heart_monitoring(patient_id):
             "code": "/min"
         }
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/Observation",
-        headers={"Content-Type": "application/fhir+json"},
-        json=heart_rate
-    )
-    
-    return response.status_code == 201
 
-def create_ultrasound_report(patient_id, gestational_age):
-    """Create an ultrasound diagnostic report"""
+def build_ultrasound_report(patient_ref, gestational_age):
+    """Build an ultrasound diagnostic report"""
     
     # Define possible findings based on gestational age
     findings = [
@@ -184,7 +163,7 @@ def create_ultrasound_report(patient_id, gestational_age):
         "Placenta in normal position"
     ]
     
-    diagnostic_report = {
+    return {
         "resourceType": "DiagnosticReport",
         "status": "final",
         "category": [
@@ -208,7 +187,7 @@ def create_ultrasound_report(patient_id, gestational_age):
             ]
         },
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "issued": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
@@ -225,18 +204,10 @@ def create_ultrasound_report(patient_id, gestational_age):
             }
         ]
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/DiagnosticReport",
-        headers={"Content-Type": "application/fhir+json"},
-        json=diagnostic_report
-    )
-    
-    return response.status_code == 201
 
-def create_fetal_movement(patient_id):
-    """Record fetal movement observation"""
-    movement = {
+def build_fetal_movement(patient_ref):
+    """Build the fetal movement observation"""
+    return {
         "resourceType": "Observation",
         "status": "final",
         "category": [
@@ -259,7 +230,7 @@ def create_fetal_movement(patient_id):
             ]
         },
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "valueCodeableConcept": {
@@ -272,50 +243,110 @@ def create_fetal_movement(patient_id):
             ]
         }
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/Observation",
-        headers={"Content-Type": "application/fhir+json"},
-        json=movement
-    )
-    
-    return response.status_code == 201
 
-def main():
-    """Generate test data for fetal health monitoring"""
-    print("Starting fetal health data generation...")
-    
-    for i in range(5):  # Generate data for 5 fetuses
-        try:
-            # Create fetal patient record
-            patient_id = create_patient()
-            print(f"Created fetal patient {i+1}/5 with ID: {patient_id}")
-            
-            # Simulate random gestational age
-            gestational_age = random.randint(12, 40)
-            
-            # Record fetal measurements
-            if create_fetal_measurements(patient_id, gestational_age):
-                print(f"Recorded fetal measurements for patient {patient_id}")
-            
-            # Record fetal heart rate
-            if create_fetal_heart_monitoring(patient_id):
-                print(f"Recorded fetal heart rate for patient {patient_id}")
-            
-            # Create ultrasound report
-            if create_ultrasound_report(patient_id, gestational_age):
-                print(f"Created ultrasound report for patient {patient_id}")
-            
-            # Record fetal movement
-            if create_fetal_movement(patient_id):
-                print(f"Recorded fetal movement for patient {patient_id}")
-            
-            print("---")
-            
-        except Exception as e:
-            print(f"Error processing fetal patient {i+1}: {str(e)}")
+def build_patient_entries(maternal_ref=None, patient_id=None):
+    """
+    Build the transaction entries for one fetal patient and all of their records.
+    The records reference the Patient through its urn:uuid fullUrl. Passing
+    patient_id creates the Patient with that id instead of a server-assigned one.
+    """
+    # Simulate random gestational age
+    gestational_age = random.randint(12, 40)
+    patient_entry = transaction_entry(build_patient(maternal_ref), resource_id=patient_id)
+    patient_ref = patient_entry["fullUrl"]
+    resources = [
+        *build_fetal_measurements(patient_ref, gestational_age),
+        build_fetal_heart_monitoring(patient_ref),
+        build_ultrasound_report(patient_ref, gestational_age),
+        build_fetal_movement(patient_ref)
+    ]
+    return [patient_entry] + [transaction_entry(resource) for resource in resources]
+
+# Gestational weeks at which the routine ultrasound scans happen
+ULTRASOUND_WEEKS = {12, 20, 32}
+
+def build_longitudinal_entries(schedule, reference_time, maternal_ref=None):
+    """
+    Yield the transaction entries for one fetus followed from the first
+    trimester scan to delivery: a growth curve of weight and length that
+    tracks gestational age, heart rate at every visit, movement from week 20
+    and ultrasound reports at the routine scans
+    """
+    start = pregnancy_start(reference_time)
+    patient_entry = transaction_entry(build_patient(maternal_ref))
+    patient_ref = patient_entry["fullUrl"]
+    yield patient_entry
     
-    print("Fetal health data generation complete!")
+    # The fetus keeps its growth percentile across visits
+    growth = random.gauss(1.0, 0.1)
+    for week, moment in visits(start, schedule, reference_time):
+        if week < 12:
+            continue
+        weight, length = build_fetal_measurements(patient_ref, week)
+        weight["valueQuantity"]["value"] = round(max(0, (week - 10) * 100) * growth + random.uniform(-20, 20), 1)
+        length["valueQuantity"]["value"] = round(max(0, (week - 10) * 2) * growth + random.uniform(-0.2, 0.2), 1)
+        
+        heart_rate = build_fetal_heart_monitoring(patient_ref)
+        # Baseline heart rate drifts down slowly over gestation
+        heart_rate["valueQuantity"]["value"] = int(random.gauss(155 - (week - 12) * 0.3, 4))
+        
+        resources = [weight, length, heart_rate]
+        if week >= 20:
+            resources.append(build_fetal_movement(patient_ref))
+        if week in ULTRASOUND_WEEKS:
+            ultrasound = build_ultrasound_report(patient_ref, week)
+            ultrasound["issued"] = fhir_datetime(moment)
+            resources.append(ultrasound)
+        
+        for resource in resources:
+            resource["effectiveDateTime"] = fhir_datetime(moment)
+            yield transaction_entry(resource)
+
+def build_templates():
+    """
+    Resource templates for the vectorized engine, derived from the builders
+    above so both engines produce the same resource shapes
+    """
+    patient = identified(build_patient())
+    patient["name"][0]["family"] = slot("family")
+    patient["identifier"][0]["value"] = slot("identifier")
+
+    weight, length = build_fetal_measurements(slot("subject"), 0)
+    weight["valueQuantity"]["value"] = slot("fetal_weight")
+    length["valueQuantity"]["value"] = slot("fetal_length")
+
+    heart_rate = build_fetal_heart_monitoring(slot("subject"))
+    heart_rate["valueQuantity"]["value"] = slot("fetal_heart_rate")
+
+    ultrasound = build_ultrasound_report(slot("subject"), 0)
+    ultrasound["issued"] = slot("effective")
+
+    movement = build_fetal_movement(slot("subject"))
+
+    records = [weight, length, heart_rate, ultrasound, movement]
+    for resource in records:
+        resource["effectiveDateTime"] = slot("effective")
+    return Template(patient), [(resource["resourceType"], Template(identified(resource))) for resource in records]
+
+def build_rows(engine, n):
+    """
+    Template values for n fetal patients of the vectorized engine: each value
+    is drawn for all n patients at once, then yielded per patient as the
+    values of the Patient and of its records
+    """
+    family = engine.names("last", n)
+    identifier = engine.integers(10000, 99999, n)
+    # Same simplified growth estimates as build_fetal_measurements, for a whole column
+    gestational_age = engine.integers(12, 40, n)
+    fetal_weight = decimals(np.maximum(0, (gestational_age - 10) * 100) + engine.uniform(-100, 100, n))
+    fetal_length = decimals(np.maximum(0, (gestational_age - 10) * 2) + engine.uniform(-1, 1, n))
+    fetal_heart_rate = engine.integers(120, 160, n)
+
+    for i in range(n):
+        yield {"family": family[i], "identifier": f'"FET{identifier[i]}"'}, {
+            "fetal_weight": fetal_weight[i], "fetal_length": fetal_length[i],
+            "fetal_heart_rate": fetal_heart_rate[i]
+        }
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    generator_cli.main(sys.modules[__name__], "fetal health")
@@ -1,14 +1,22 @@
-import requests
 import json
+import os
+import sys
 from datetime import datetime, timedelta
 import random
 import names
+# The FHIR client and the command line shared by every server's generator live
+# in generator-common, next to the server directories (also inside the image)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "generator-common"))
+import generator_cli
+from fhir_client import transaction_entry
+from timeline import pregnancy_start, at_week, visits, fhir_datetime
+from synthetic import Template, slot, identified
 
-BASE_URL = "http://obstetric-fhir:8080/fhir"
+BASE_URL = os.getenv("FHIR_BASE_URL", "http://obstetric-fhir:8080/fhir")
 
-def create_patient():
-    """Create a patient record for obstetric care"""
-    patient_data = {
+def build_patient():
+    """Build a patient resource for obstetric care"""
+    return {
         "resourceType": "Patient",
         "active": True,
         "name": [
@@ -27,32 +35,37 @@ def create_patient():
             }
         ]
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/Patient",
-        headers={"Content-Type": "application/fhir+json"},
-        json=patient_data
-    )
-    
-    if response.status_code == 201:
-        return response.json()["id"]
-    else:
-        raise Exception(f"Failed to create patient: {response.text}")
 
-def create_delivery_plan(patient_id):
-    """Create a care plan for delivery"""
-    delivery_methods = [
-        {"code": "386637004", "display": "Vaginal delivery"},
-        {"code": "11466000", "display": "Cesarean section"}
-    ]
-    selected_method = random.choice(delivery_methods)
+DELIVERY_METHODS = [
+    {"code": "386637004", "display": "Vaginal delivery"},
+    {"code": "11466000", "display": "Cesarean section"}
+]
+
+RISK_FACTORS = [
+    {
+        "code": "161766001",
+        "display": "History of previous cesarean section"
+    },
+    {
+        "code": "199745000",
+        "display": "Elderly primigravida"
+    },
+    {
+        "code": "48194001",
+        "display": "Pregnancy-induced hypertension"
+    }
+]
+
+def build_delivery_plan(patient_ref, fetal_refs=()):
+    """Build a care plan for delivery, optionally referencing the fetal records"""
+    selected_method = random.choice(DELIVERY_METHODS)
     
     care_plan = {
         "resourceType": "CarePlan",
         "status": "active",
         "intent": "plan",
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "category": [
             {
@@ -88,38 +101,20 @@ def create_delivery_plan(patient_id):
         ]
     }
     
-    response = requests.post(
-        f"{BASE_URL}/CarePlan",
-        headers={"Content-Type": "application/fhir+json"},
-        json=care_plan
-    )
+    if fetal_refs:
+        care_plan["supportingInfo"] = [{"reference": fetal_ref} for fetal_ref in fetal_refs]
     
-    return response.status_code == 201
+    return care_plan
 
-def create_risk_assessment(patient_id):
-    """Create a risk assessment for pregnancy"""
-    risk_factors = [
-        {
-            "code": "161766001",
-            "display": "History of previous cesarean section"
-        },
-        {
-            "code": "199745000",
-            "display": "Elderly primigravida"
-        },
-        {
-            "code": "48194001",
-            "display": "Pregnancy-induced hypertension"
-        }
-    ]
-    
-    selected_risks = random.sample(risk_factors, random.randint(0, 2))
+def build_risk_assessment(patient_ref):
+    """Build a risk assessment for pregnancy"""
+    selected_risks = random.sample(RISK_FACTORS, random.randint(0, 2))
     
-    risk_assessment = {
+    return {
         "resourceType": "RiskAssessment",
         "status": "final",
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "occurrenceDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "condition": {
@@ -132,31 +127,27 @@ def create_risk_assessment(patient_id):
             ]
         },
         "prediction": [
-            {
-                "outcome": {
-                    "coding": [
-                        {
-                            "system": "http://snomed.info/sct",
-                            "code": risk["code"],
-                            "display": risk["display"]
-                        }
-                    ]
-                },
-                "probabilityDecimal": random.uniform(0.1, 0.5)
-            } for risk in selected_risks
+            build_prediction(risk, random.uniform(0.1, 0.5)) for risk in selected_risks
         ] if selected_risks else []
     }
-    
-    response = requests.post(
-        f"{BASE_URL}/RiskAssessment",
-        headers={"Content-Type": "application/fhir+json"},
-        json=risk_assessment
-    )
-    
-    return response.status_code == 201
 
-def create_labor_progress(patient_id):
-    """Create labor progress observations"""
+def build_prediction(risk, probability):
+    """Build one RiskAssessment prediction for a risk factor"""
+    return {
+        "outcome": {
+            "coding": [
+                {
+                    "system": "http://snomed.info/sct",
+                    "code": risk["code"],
+                    "display": risk["display"]
+                }
+            ]
+        },
+        "probabilityDecimal": probability
+    }
+
+def build_labor_progress(patient_ref):
+    """Build labor progress observations"""
     cervical_dilation = {
         "resourceType": "Observation",
         "status": "final",
@@ -180,7 +171,7 @@ def create_labor_progress(patient_id):
             ]
         },
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "valueQuantity": {
@@ -214,7 +205,7 @@ def create_labor_progress(patient_id):
             ]
         },
         "subject": {
-            "reference": f"Patient/{patient_id}"
+            "reference": patient_ref
         },
         "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
         "component": [
@@ -238,21 +229,10 @@ def create_labor_progress(patient_id):
         ]
     }
     
-    success = True
-    for observation in [cervical_dilation, contraction_monitoring]:
-        response = requests.post(
-            f"{BASE_URL}/Observation",
-            headers={"Content-Type": "application/fhir+json"},
-            json=observation
-        )
-        if response.status_code != 201:
-            success = False
-            print(f"Failed to create labor observation: {response.text}")
-    
-    return success
+    return [cervical_dilation, contraction_monitoring]
 
-def create_complications_monitoring(patient_id):
-    """Create monitoring for potential complications"""
+def build_complications_monitoring(patient_ref):
+    """Build monitoring observations for potential complications"""
     complications = [
         {
             "code": "198609003",
@@ -264,9 +244,8 @@ def create_complications_monitoring(patient_id):
         }
     ]
     
-    success = True
-    for complication in complications:
-        observation = {
+    return [
+        {
             "resourceType": "Observation",
             "status": "final",
             "category": [
@@ -289,7 +268,7 @@ def create_complications_monitoring(patient_id):
                 ]
             },
             "subject": {
-                "reference": f"Patient/{patient_id}"
+                "reference": patient_ref
             },
             "effectiveDateTime": datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ"),
             "valueCodeableConcept": {
@@ -301,52 +280,148 @@ def create_complications_monitoring(patient_id):
                     }
                 ]
             }
-        }
-        
-        response = requests.post(
-            f"{BASE_URL}/Observation",
-            headers={"Content-Type": "application/fhir+json"},
-            json=observation
-        )
-        
-        if response.status_code != 201:
-            success = False
-            print(f"Failed to create complication monitoring: {response.text}")
-    
-    return success
+        } for complication in complications
+    ]
+
+def build_care_entries(patient_ref, fetal_refs=()):
+    """Build the transaction entries for the obstetric records of an existing patient"""
+    resources = [
+        build_delivery_plan(patient_ref, fetal_refs),
+        build_risk_assessment(patient_ref),
+        *build_labor_progress(patient_ref),
+        *build_complications_monitoring(patient_ref)
+    ]
+    return [transaction_entry(resource) for resource in resources]
+
+def build_patient_entries():
+    """
+    Build the transaction entries for one obstetric patient and all of their records.
+    The records reference the Patient through its urn:uuid fullUrl.
+    """
+    patient_entry = transaction_entry(build_patient())
+    return [patient_entry] + build_care_entries(patient_entry["fullUrl"])
 
-def main():
-    """Generate test data for obstetric care"""
-    print("Starting obstetric care data generation...")
+def build_longitudinal_entries(schedule, reference_time):
+    """
+    Yield the transaction entries for one patient followed from booking to
+    delivery: the delivery plan and risk assessment at the booking visit,
+    complications screening at the first visit from week 24, and hourly labor
+    progression observations once labor has started
+    """
+    start = pregnancy_start(reference_time)
+    patient_entry = transaction_entry(build_patient())
+    patient_ref = patient_entry["fullUrl"]
+    yield patient_entry
     
-    for i in range(5):  # Generate data for 5 patients
-        try:
-            # Create patient
-            patient_id = create_patient()
-            print(f"Created obstetric patient {i+1}/5 with ID: {patient_id}")
-            
-            # Create delivery plan
-            if create_delivery_plan(patient_id):
-                print(f"Created delivery plan for patient {patient_id}")
-            
-            # Create risk assessment
-            if create_risk_assessment(patient_id):
-                print(f"Created risk assessment for patient {patient_id}")
-            
-            # Create labor progress observations
-            if create_labor_progress(patient_id):
-                print(f"Recorded labor progress for patient {patient_id}")
-            
-            # Create complications monitoring
-            if create_complications_monitoring(patient_id):
-                print(f"Created complications monitoring for patient {patient_id}")
-            
-            print("---")
-            
-        except Exception as e:
-            print(f"Error processing obstetric patient {i+1}: {str(e)}")
+    booking = True
+    screened = False
+    for week, moment in visits(start, schedule, reference_time):
+        resources = []
+        if booking:
+            care_plan = build_delivery_plan(patient_ref)
+            care_plan["created"] = fhir_datetime(moment)
+            care_plan["activity"][0]["detail"]["scheduledPeriod"]["start"] = at_week(start, 40).strftime("%Y-%m-%d")
+            risk_assessment = build_risk_assessment(patient_ref)
+            risk_assessment["occurrenceDateTime"] = fhir_datetime(moment)
+            resources.extend([care_plan, risk_assessment])
+            booking = False
+        if week >= 24 and not screened:
+            for observation in build_complications_monitoring(patient_ref):
+                observation["effectiveDateTime"] = fhir_datetime(moment)
+                resources.append(observation)
+            screened = True
+        for resource in resources:
+            yield transaction_entry(resource)
     
-    print("Obstetric care data generation complete!")
+    # Active labor from 4 cm, dilating about 1 cm an hour with contractions closing in
+    labor_start = at_week(start, random.randint(37, 41), hours=random.randint(0, 23))
+    dilation_cm = 4
+    hour = 0
+    while dilation_cm <= 10 and at_week(labor_start, 0, hours=hour) <= reference_time:
+        dilation, contractions = build_labor_progress(patient_ref)
+        dilation["valueQuantity"]["value"] = dilation_cm
+        contractions["component"][0]["valueQuantity"]["value"] = max(2, 5 - hour // 2)
+        for observation in (dilation, contractions):
+            observation["effectiveDateTime"] = fhir_datetime(at_week(labor_start, 0, hours=hour))
+            yield transaction_entry(observation)
+        dilation_cm += random.choice([1, 1, 2])
+        hour += 1
+
+def build_templates():
+    """
+    Resource templates for the vectorized engine, derived from the builders
+    above so both engines produce the same resource shapes
+    """
+    patient = identified(build_patient())
+    patient["name"][0]["family"] = slot("family")
+    patient["name"][0]["given"] = [slot("given")]
+    patient["birthDate"] = slot("birth_date")
+    patient["identifier"][0]["value"] = slot("identifier")
+
+    care_plan = build_delivery_plan(slot("subject"))
+    care_plan["title"] = slot("plan_title")
+    care_plan["description"] = slot("plan_description")
+    care_plan["activity"][0]["detail"]["code"]["coding"][0]["code"] = slot("method_code")
+    care_plan["activity"][0]["detail"]["code"]["coding"][0]["display"] = slot("method_display")
+    care_plan["activity"][0]["detail"]["scheduledPeriod"]["start"] = slot("delivery_date")
+
+    risk_assessment = build_risk_assessment(slot("subject"))
+    risk_assessment["occurrenceDateTime"] = slot("effective")
+    risk_assessment["prediction"] = slot("predictions")
+
+    dilation, contractions = build_labor_progress(slot("subject"))
+    dilation["valueQuantity"]["value"] = slot("dilation")
+    contractions["component"][0]["valueQuantity"]["value"] = slot("contraction_interval")
+
+    complications = build_complications_monitoring(slot("subject"))
+
+    for resource in [dilation, contractions, *complications]:
+        resource["effectiveDateTime"] = slot("effective")
+    records = [care_plan, risk_assessment, dilation, contractions, *complications]
+    return Template(patient), [(resource["resourceType"], Template(identified(resource))) for resource in records]
+
+def build_rows(engine, n):
+    """
+    Template values for n obstetric patients of the vectorized engine: each
+    value is drawn for all n patients at once, then yielded per patient as
+    the values of the Patient and of its records
+    """
+    predictions = [Template(build_prediction(risk, slot("probability"))) for risk in RISK_FACTORS]
+    methods = [
+        {
+            "plan_title": json.dumps(f"Delivery Plan - {method['display']}"),
+            "plan_description": json.dumps(f"Planned {method['display']} with standard monitoring and care protocols"),
+            "method_code": json.dumps(method["code"]),
+            "method_display": json.dumps(method["display"])
+        } for method in DELIVERY_METHODS
+    ]
+    family = engine.names("last", n)
+    given = engine.names("first:female", n)
+    birth_date = engine.dates(-engine.integers(7300, 10950, n))
+    identifier = engine.integers(10000, 99999, n)
+    method = engine.choice(methods, n)
+    delivery_date = engine.dates(engine.integers(30, 90, n))
+    # Up to two distinct risk factors per patient, like random.sample
+    risk_count = engine.integers(0, 2, n)
+    risk_order = engine.orderings(len(RISK_FACTORS), n)
+    risk_probability = engine.uniform(0.1, 0.5, (n, 2))
+    dilation = engine.integers(1, 10, n)
+    contraction_interval = engine.integers(2, 5, n)
+
+    for i in range(n):
+        stamped = ",".join(
+            predictions[risk_order[i, k]].stamp(probability=risk_probability[i, k])
+            for k in range(risk_count[i])
+        )
+        yield {
+            "family": family[i], "given": given[i], "birth_date": birth_date[i],
+            "identifier": f'"OBS{identifier[i]}"'
+        }, {
+            "delivery_date": delivery_date[i], "predictions": f"[{stamped}]",
+            "dilation": dilation[i], "contraction_interval": contraction_interval[i],
+            **method[i]
+        }
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    generator_cli.main(sys.modules[__name__], "obstetric care")
+